@@ -0,0 +1,43 @@
+import numpy as np
+
+
+DIMENSIONS = ['year', 'account_amt_currency_code', 'client_id', 'loan_indicator']
+MEASURES = ['account_amt_credit_limit', 'overall_val_credit_total_amt', 'overall_val_credit_total_monetary_amt']
+
+
+# Предрасчитанный куб агрегатов год × валюта × клиент × признак погашения.
+# Для каждой меры хранятся сумма и количество заполненных значений (среднее = сумма / количество),
+# поэтому любые срезы по фильтрам сворачиваются без повторного прохода по строкам df.
+class AggregateCube:
+    def __init__(self, df):
+        aggregations = {'rows': ('client_id', 'size')}
+        for measure in MEASURES:
+            aggregations[f'{measure}_sum'] = (measure, 'sum')
+            aggregations[f'{measure}_count'] = (measure, 'count')
+        # observed=True: у категорий (валюта) не появляются пустые сочетания
+        self.cells = df.groupby(DIMENSIONS, dropna=False, observed=True).agg(**aggregations).reset_index()
+
+    def slice(self, conditions):
+        # conditions - список пар (колонка, значение), как у FilterIndex.select
+        mask = np.ones(len(self.cells), dtype=bool)
+        for column, value in conditions:
+            mask &= (self.cells[column] == value).to_numpy()
+        return self.cells[mask]
+
+    @staticmethod
+    def rollup(cells, by):
+        columns = [column for column in cells.columns if column.endswith(('_sum', '_count')) or column == 'rows']
+        rolled = cells.groupby(by, observed=True)[columns].sum()
+        for measure in MEASURES:
+            rolled[f'{measure}_mean'] = rolled[f'{measure}_sum'] / rolled[f'{measure}_count'].replace(0, np.nan)
+        return rolled.reset_index()
+
+    @staticmethod
+    def totals(cells):
+        closed = cells[cells['loan_indicator'] == 1]
+        return {
+            'total_loans': int(cells['rows'].sum()),
+            'total_closed': (cells['loan_indicator'].fillna(0) * cells['rows']).sum(),
+            'total_amount': cells['account_amt_credit_limit_sum'].sum(),
+            'total_closed_amount': closed['account_amt_credit_limit_sum'].sum()
+        }
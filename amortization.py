@@ -0,0 +1,106 @@
+import numpy as np
+import pandas as pd
+
+
+# Ограничение горизонта прогноза: у карт и бессрочных договоров дата закрытия бывает 2099-2260 годом
+HORIZON_MONTHS = 360
+# Код частоты платежей (справочник 2.5) -> период между платежами в месяцах.
+# Платежи чаще раза в месяц (1, 2) суммируются в месяц, 7 - единовременно в конце срока (период = срок),
+# 8, 9, 99 и пропуски считаем ежемесячными.
+PERIOD_MONTHS = {1: 1, 2: 1, 3: 1, 4: 3, 5: 6, 6: 12}
+BULLET = 7
+# Сколько событий платежей разворачивается за один проход
+EVENT_BATCH = 2_000_000
+
+
+def _month_number(dates):
+    dates = pd.to_datetime(dates, errors='coerce')
+    return (dates.dt.year * 12 + dates.dt.month - 1).to_numpy(dtype=float)
+
+
+# Векторный прогноз платежей по открытым кредитам: аннуитет по ПСК на остаток основного долга
+# от месяца отчета до даты закрытия. Параметры кредитов считаются один раз при загрузке,
+# поток платежей строится для выборки целиком, без циклов по кредитам.
+class AmortizationSchedule:
+    def __init__(self, df):
+        report_month = _month_number(df['reporting_dt'])
+        close_month = _month_number(df['trade_close_dt'])
+        # Открытые кредиты: нет основания прекращения и дата закрытия после даты отчета
+        open_mask = (df['loan_indicator'].isna().to_numpy() & ~np.isnan(report_month)
+                     & ~np.isnan(close_month) & (close_month > report_month))
+        # Остаток основного долга, при отсутствии - лимит кредита
+        principal = df['arrear_principal_outstanding'].fillna(df['account_amt_credit_limit']).to_numpy(dtype=float)
+        open_mask &= np.nan_to_num(principal) > 0
+
+        frequency = df['paymnt_condition_terms_frequency'].to_numpy(dtype=float)
+        self.rows = np.flatnonzero(open_mask)
+        self.size = len(df)
+        self.start = report_month[open_mask].astype(np.int64)
+        self.term = np.minimum(close_month[open_mask] - report_month[open_mask], HORIZON_MONTHS).astype(np.int64)
+        self.principal = principal[open_mask]
+        self.annual_rate = np.nan_to_num(df['overall_val_credit_total_amt'].to_numpy(dtype=float)[open_mask]) / 100
+        period = np.ones(len(self.rows), dtype=np.int64)
+        for code, months in PERIOD_MONTHS.items():
+            period[frequency[open_mask] == code] = months
+        bullet = frequency[open_mask] == BULLET
+        period[bullet] = self.term[bullet]
+        self.period = np.minimum(period, self.term)
+        # Беспроцентный период: платежи до месяца окончания льготы идут без процентов.
+        # paymnt_condition_grace_start_dt по справочнику - сумма минимального платежа по карте, не дата.
+        grace_end = _month_number(df['paymnt_condition_grace_end_dt'])[open_mask]
+        self.grace_end = np.where(np.isnan(grace_end), -1, grace_end).astype(np.int64)
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in (self.rows, self.start, self.term, self.principal,
+                                              self.annual_rate, self.period, self.grace_end))
+
+    def cash_flows(self, positions=None):
+        # positions - позиции строк выборки в исходном df; None - весь портфель.
+        # Результат: помесячный поток платежей (month, principal, interest).
+        if positions is None:
+            loans = np.arange(len(self.rows))
+        else:
+            selected = np.zeros(self.size, dtype=bool)
+            selected[positions] = True
+            loans = np.flatnonzero(selected[self.rows])
+        if len(loans) == 0:
+            return pd.DataFrame({'month': pd.DatetimeIndex([]), 'principal': [], 'interest': []})
+
+        term, period = self.term[loans], self.period[loans]
+        payments = -(-term // period)  # число платежей, последний - в месяц закрытия
+        first = int(self.start[loans].min()) + 1
+        length = int((self.start[loans] + term).max()) - first + 1
+        principal_flow = np.zeros(length)
+        interest_flow = np.zeros(length)
+        # События платежей разворачиваются пачками кредитов, чтобы память не зависела от размера портфеля
+        batch = np.searchsorted(np.cumsum(payments), np.arange(0, payments.sum(), EVENT_BATCH), side='right')
+        for lo, hi in zip(batch, np.append(batch[1:], len(loans))):
+            index, principal, interest = self._payments(loans[lo:hi], payments[lo:hi])
+            principal_flow += np.bincount(index - first, weights=principal, minlength=length)
+            interest_flow += np.bincount(index - first, weights=interest, minlength=length)
+        return pd.DataFrame({
+            'month': pd.date_range(pd.Timestamp(year=first // 12, month=first % 12 + 1, day=1),
+                                   periods=length, freq='MS'),
+            'principal': principal_flow,
+            'interest': interest_flow
+        })
+
+    def _payments(self, loans, payments):
+        term, period = self.term[loans], self.period[loans]
+        rate = self.annual_rate[loans] / 12 * period  # ставка за период между платежами
+
+        # Каждый платеж - отдельное событие: (кредит, номер платежа j = 1..N)
+        loan = np.repeat(np.arange(len(loans)), payments)
+        j = np.arange(len(loan)) - np.repeat(np.cumsum(payments) - payments, payments) + 1
+        n, r, principal = payments[loan], rate[loan], self.principal[loans][loan]
+
+        # Остаток после j-го аннуитетного платежа: P * ((1+r)^N - (1+r)^j) / ((1+r)^N - 1), при r = 0 - линейно
+        growth_n, growth_j, growth_prev = (1 + r) ** n, (1 + r) ** j, (1 + r) ** (j - 1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            balance_after = np.where(r > 0, principal * (growth_n - growth_j) / (growth_n - 1), principal * (1 - j / n))
+            balance_before = np.where(r > 0, principal * (growth_n - growth_prev) / (growth_n - 1),
+                                      principal * (1 - (j - 1) / n))
+        month = self.start[loans][loan] + np.minimum(j * period[loan], term[loan])
+        interest = np.where(month < self.grace_end[loans][loan], 0.0, r * balance_before)
+        return month, balance_before - balance_after, interest
@@ -0,0 +1,182 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from ingest import peak_rss_mb
+
+
+# Замеряемые колбэки: имя -> (выход, входы по Store выборки, состояния)
+CALLBACKS = {
+    'update_graphs': ('amount-by-year.figure', lambda store: [store], []),
+    'update_additional_elements': ('loan-kind-pie.figure', lambda store: [store], []),
+    'update_payment_chart': ('payment-schedule.figure', lambda store: [store, None], []),
+    'update_cumulative_debt': ('cumulative-debt.figure', lambda store: [store, None], []),
+    'update_income_plot': ('income-slider.marks', lambda store: [store], [None]),
+}
+
+
+# Заглушка GigaChat: колбэки с LLM замеряются без сети
+class StubGigaChat:
+    def chat(self, prompt):
+        return "Рекомендации (заглушка бенчмарка)"
+
+    def stats(self):
+        return {}
+
+
+def _find_callback(app, output):
+    for key, spec in app.callback_map.items():
+        if output in key and '@' not in key:
+            return key, spec
+    raise KeyError(output)
+
+
+# Вызов колбэка так же, как его вызывает браузер: POST /_dash-update-component
+def dispatch(app, client, output, inputs, state=(), triggered=None):
+    key, spec = _find_callback(app, output)
+
+    def values(specs, vals):
+        return [dict(item, value=value) for item, value in zip(specs, vals)]
+
+    outputs = ([{'id': part.split('.')[0], 'property': part.split('.')[1]} for part in key.strip('.').split('...')]
+               if key.startswith('..') else {'id': key.split('.')[0], 'property': key.split('.')[1]})
+    payload = {'output': key, 'outputs': outputs, 'inputs': values(spec['inputs'], inputs),
+               'state': values(spec.get('state', []), state), 'changedPropIds': [triggered] if triggered else []}
+    started = time.perf_counter()
+    response = client.post('/_dash-update-component', json=payload)
+    elapsed = time.perf_counter() - started
+    if response.status_code != 200:
+        raise RuntimeError(f"{output}: HTTP {response.status_code}")
+    return elapsed, response.data
+
+
+def _timed(fn, repeat):
+    # Первый вызов - холодный (кэши пусты), остальные - повторный выбор тех же фильтров
+    cold, payload = fn()
+    warm = sorted(fn()[0] for _ in range(repeat))
+    return {'cold_ms': round(cold * 1000, 2), 'warm_ms': round(warm[len(warm) // 2] * 1000, 2) if warm else None,
+            'payload_bytes': len(payload)}
+
+
+def _get(client, url):
+    started = time.perf_counter()
+    response = client.get(url)
+    return time.perf_counter() - started, response.data
+
+
+# Запуск до готовности: импорт main и первые запросы браузера (страница, макет, описание колбэков)
+def startup(load_seconds, client):
+    index_seconds, index = _get(client, '/')
+    layout_seconds, layout = _get(client, '/_dash-layout')
+    warm_layout_seconds, _ = _get(client, '/_dash-layout')
+    _, dependencies = _get(client, '/_dash-dependencies')
+    return {'import_seconds': round(load_seconds, 3),
+            'ready_seconds': round(load_seconds + index_seconds + layout_seconds, 3),
+            'layout_cold_ms': round(layout_seconds * 1000, 2), 'layout_warm_ms': round(warm_layout_seconds * 1000, 2),
+            'index_bytes': len(index), 'layout_bytes': len(layout), 'dependencies_bytes': len(dependencies)}
+
+
+# Замер в отдельном процессе: main.py загружает CLIENT_FILE_PATH при импорте, пик RSS - на один размер данных
+def run_child(path, repeat, startup_only=False):
+    started = time.perf_counter()
+    import main
+    load_seconds = time.perf_counter() - started
+    main.giga_pool = StubGigaChat()
+
+    client = main.app.server.test_client()
+    result = {'rows': len(main.df), 'file_bytes': os.path.getsize(path), 'startup': startup(load_seconds, client)}
+    if startup_only:
+        result['memory'] = main.memory_report()
+        return result
+
+    import pandas as pd
+
+    started = time.perf_counter()
+    pd.read_csv(path, delimiter=';')
+    result['csv_read_seconds'] = round(time.perf_counter() - started, 3)
+    result['selections'] = {}
+
+    years = main.df['year'].value_counts()
+    selections = {'all': 'all'}
+    if len(years):
+        selections['top_year'] = int(years.index[0])
+    for name, year in selections.items():
+        filters = [year, 'all', 'all', None, None, 0]
+        store = {}
+
+        def unified():
+            elapsed, payload = dispatch(main.app, client, 'crossfilter-selection.data', filters, [None, None, None],
+                                        'year-filter.value')
+            store.update(json.loads(payload)['response']['crossfilter-selection']['data'])
+            return elapsed, payload
+
+        timings = {'unified_callback': _timed(unified, repeat)}
+        for callback_name, (output, inputs, state) in CALLBACKS.items():
+            timings[callback_name] = _timed(
+                lambda: dispatch(main.app, client, output, inputs(store), state, 'crossfilter-selection.data'), repeat)
+        result['selections'][name] = timings
+    result['peak_rss_mb'] = round(peak_rss_mb(), 1)
+    # Своя память воркера и общие страницы снимка (см. snapshot.memory_report)
+    result['memory'] = main.memory_report()
+    return result
+
+
+def run(sizes, output, repeat=3, seed=0, directory=None, startup_only=False):
+    from synthetic import generate
+
+    directory = directory or tempfile.mkdtemp(prefix='bench-')
+    os.makedirs(directory, exist_ok=True)
+    runs = []
+    for rows in sizes:
+        path = os.path.join(directory, f'synthetic_{rows}.csv')
+        if not os.path.exists(path):
+            started = time.perf_counter()
+            generate(path, rows, seed)
+            print(f"Сгенерировано {rows} строк за {time.perf_counter() - started:.1f} с", file=sys.stderr)
+        env = dict(os.environ, CLIENT_FILE_PATH=path,
+                   PARTITION_DIR=os.path.join(directory, f'partitions_{rows}'),
+                   SNAPSHOT_DIR=os.path.join(directory, f'snapshot_{rows}'),
+                   LLM_CACHE_PATH=os.path.join(directory, 'llm_cache.sqlite3'),
+                   KEY_RATE_STORE=os.path.join(directory, 'key_rate.csv'))
+        command = [sys.executable, os.path.abspath(__file__), '--child', path, '--repeat', str(repeat)]
+        started = time.perf_counter()
+        completed = subprocess.run(command + (['--startup'] if startup_only else []),
+                                   env=env, capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        process_seconds = time.perf_counter() - started
+        if completed.returncode != 0:
+            runs.append({'rows': rows, 'error': completed.stderr.strip().splitlines()[-1:]})
+        else:
+            runs.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+            if startup_only:
+                # Полное время процесса, включая запуск интерпретатора
+                runs[-1]['startup']['process_seconds'] = round(process_seconds, 3)
+        print(json.dumps(runs[-1], ensure_ascii=False), file=sys.stderr)
+
+    results = {'created': datetime.now().isoformat(timespec='seconds'), 'python': platform.python_version(),
+               'platform': platform.platform(), 'repeat': repeat, 'seed': seed, 'runs': runs}
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Бенчмарк колбэков на синтетических выгрузках")
+    parser.add_argument('--rows', type=int, nargs='+', default=[10_000, 100_000])
+    parser.add_argument('--output', default='bench_output.json')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--data-dir', help="Папка для сгенерированных файлов (по умолчанию - временная)")
+    parser.add_argument('--startup', action='store_true', help="Только запуск: импорт, макет, размер начальной страницы")
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_child(args.child, args.repeat, args.startup), ensure_ascii=False))
+    else:
+        run(args.rows, args.output, args.repeat, args.seed, args.data_dir, args.startup)
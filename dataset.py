@@ -0,0 +1,86 @@
+from functools import cached_property
+
+from filter_index import FilterIndex
+from debt_series import DebtEvents
+from agg_cube import AggregateCube
+from payment_history import PaymentHistory, load_payment_history
+from amortization import AmortizationSchedule
+from dti import DebtToIncome
+from schema import apply_schema
+
+
+# Предобработка выгрузки: расшифровка кодов, год выдачи и типы колонок по схеме
+def prepare_loans(df, mapping_tables):
+    # Замена кодов вида займа и цели кредита на текстовые значения
+    df['trade_loan_kind_code'] = mapping_tables.translate('trade_loan_kind_code', df['trade_loan_kind_code'])
+    df['trade_acct_type1'] = mapping_tables.translate('trade_acct_type1', df['trade_acct_type1'])
+    df = apply_schema(df)
+    df["year"] = df["fund_date"].dt.year
+    return df
+
+
+# Таблица кредитов вместе со структурами, построенными по ней. Структуры строятся при первом обращении:
+# запуск приложения не ждет индексов портфеля, первый колбэк строит только то, что ему нужно.
+# snapshot - снимок, из которого отображена таблица (портфель): крупные структуры берутся из его папки
+class Dataset:
+    def __init__(self, df, snapshot=None):
+        self.df = df
+        self.snapshot = snapshot
+
+    @cached_property
+    def filter_index(self):
+        # Индекс по измерениям фильтров
+        return FilterIndex(self.df, ['year', 'account_amt_currency_code', 'client_id'])
+
+    @cached_property
+    def debt_events(self):
+        # События выдачи/погашения для графика общей задолженности
+        return DebtEvents(self.df)
+
+    @cached_property
+    def agg_cube(self):
+        # Куб агрегатов для KPI и графиков по годам
+        return AggregateCube(self.df)
+
+    @cached_property
+    def payment_history(self):
+        # Матрица состояний платежной истории attr_value по календарным месяцам;
+        # у портфеля - общая для воркеров матрица в папке снимка, у раздела клиента - своя небольшая
+        if self.snapshot is not None:
+            return load_payment_history(self.snapshot)
+        return PaymentHistory(self.df)
+
+    @cached_property
+    def amortization(self):
+        # Параметры открытых кредитов для прогноза графика платежей
+        return AmortizationSchedule(self.df)
+
+    @cached_property
+    def debt_to_income(self):
+        # Ежемесячные платежи кредитов для сценариев дохода (ПДН)
+        return DebtToIncome(self.df)
+
+    @cached_property
+    def frame_nbytes(self):
+        return int(self.df.memory_usage(deep=True).sum())
+
+    @property
+    def nbytes(self):
+        # Оценка занимаемой памяти для LRU разделов: таблица и только уже построенные структуры
+        # (cached_property хранит построенное в __dict__), сама оценка ничего не строит
+        built = self.__dict__
+        nbytes = self.frame_nbytes
+        if 'filter_index' in built:
+            nbytes += 8 * len(self.df) * 3  # позиции индекса фильтров
+        if 'debt_events' in built:
+            events = built['debt_events']
+            nbytes += events.dates.nbytes + events.amounts.nbytes + events.rows.nbytes + events.cumulative.nbytes
+        if 'agg_cube' in built:
+            nbytes += int(built['agg_cube'].cells.memory_usage(deep=True).sum())
+        if 'payment_history' in built:
+            nbytes += built['payment_history'].matrix.nbytes
+        if 'amortization' in built:
+            nbytes += built['amortization'].nbytes
+        if 'debt_to_income' in built:
+            nbytes += built['debt_to_income'].nbytes
+        return int(nbytes)
@@ -0,0 +1,43 @@
+import numpy as np
+import pandas as pd
+
+
+# Нарастающий итог с пропуском NaN (как pandas cumsum): NaN-точка остается NaN, но не обнуляет сумму
+def _cumsum(amounts):
+    cumulative = np.cumsum(np.nan_to_num(amounts, nan=0.0))
+    cumulative[np.isnan(amounts)] = np.nan
+    return cumulative
+
+
+# Таблица событий выдачи/погашения для графика общей задолженности.
+# Строится один раз векторными операциями, события отсортированы по дате,
+# для полного портфеля заранее посчитаны префиксные суммы.
+class DebtEvents:
+    def __init__(self, df):
+        amount = (df['account_amt_credit_limit'] + df['overall_val_credit_total_monetary_amt']).to_numpy(dtype=float)
+        issue_mask = df['fund_date'].notna().to_numpy()
+        repayment_mask = (df['loan_indicator_dt'].notna() & (df['loan_indicator'] == 1)).to_numpy()
+        rows = np.arange(len(df))
+
+        dates = np.concatenate([df['fund_date'].to_numpy(dtype='datetime64[ns]')[issue_mask],
+                                df['loan_indicator_dt'].to_numpy(dtype='datetime64[ns]')[repayment_mask]])
+        amounts = np.concatenate([amount[issue_mask], -amount[repayment_mask]])
+        event_rows = np.concatenate([rows[issue_mask], rows[repayment_mask]])
+        kinds = np.concatenate([np.zeros(issue_mask.sum(), dtype=np.int8), np.ones(repayment_mask.sum(), dtype=np.int8)])
+
+        # Сортировка по дате; при равных датах - порядок строк df, выдача раньше погашения
+        order = np.lexsort((kinds, event_rows, dates))
+        self.size = len(df)
+        self.dates = dates[order]
+        self.amounts = amounts[order]
+        self.rows = event_rows[order]
+        self.cumulative = _cumsum(self.amounts)
+
+    def series(self, positions=None):
+        # positions - позиции строк выборки в исходном df; None - весь портфель
+        if positions is None:
+            return pd.DataFrame({'date': self.dates, 'cumulative': self.cumulative})
+        selected = np.zeros(self.size, dtype=bool)
+        selected[positions] = True
+        mask = selected[self.rows]
+        return pd.DataFrame({'date': self.dates[mask], 'cumulative': _cumsum(self.amounts[mask])})
@@ -0,0 +1,71 @@
+import os
+
+import numpy as np
+
+
+# Сколько точек графика отдается в браузер без прореживания; выше порога - LTTB/min-max и WebGL
+THRESHOLD = int(os.getenv('DOWNSAMPLE_THRESHOLD', 5000))
+
+
+def _as_numbers(x):
+    x = np.asarray(x)
+    if np.issubdtype(x.dtype, np.datetime64):
+        x = x.astype('datetime64[ns]')
+        return np.where(np.isnat(x), np.nan, x.astype(np.int64).astype(float))
+    return x.astype(float)
+
+
+# Largest-Triangle-Three-Buckets: из каждой корзины берется точка с наибольшей площадью треугольника
+# с предыдущей выбранной точкой и средним следующей корзины. Сохраняет форму линии (пики, ступени).
+# Возвращает индексы выбранных точек; x должен быть отсортирован.
+def lttb(x, y, threshold=THRESHOLD):
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    xs, ys = _as_numbers(x), np.nan_to_num(np.asarray(y, dtype=float))
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)  # корзины без первой и последней точки
+    # Средние корзин считаются сразу для всех корзин
+    sums_x, sums_y = np.add.reduceat(xs, edges[:-1]), np.add.reduceat(ys, edges[:-1])
+    counts = np.diff(edges)
+    means_x = np.append(sums_x / counts, xs[-1])
+    means_y = np.append(sums_y / counts, ys[-1])
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    previous = 0
+    for bucket in range(threshold - 2):
+        lo, hi = edges[bucket], edges[bucket + 1]
+        # Удвоенная площадь треугольника (previous, точка корзины, среднее следующей корзины)
+        area = np.abs((xs[previous] - means_x[bucket + 1]) * (ys[lo:hi] - ys[previous])
+                      - (xs[previous] - xs[lo:hi]) * (means_y[bucket + 1] - ys[previous]))
+        previous = lo + int(np.argmax(area))
+        selected[bucket + 1] = previous
+    return selected
+
+
+# Min/max по корзинам оси x: для облака маркеров сохраняет экстремумы каждой корзины. Полностью векторно.
+def minmax_buckets(x, y, threshold=THRESHOLD):
+    n = len(x)
+    if threshold >= n or threshold < 2:
+        return np.arange(n)
+    xs, ys = _as_numbers(x), np.asarray(y, dtype=float)
+    valid = ~np.isnan(xs) & ~np.isnan(ys)
+    positions = np.flatnonzero(valid)
+    if len(positions) <= threshold:
+        return positions
+    buckets = threshold // 2
+    span = xs[positions].max() - xs[positions].min()
+    bucket = np.minimum(((xs[positions] - xs[positions].min()) / (span or 1) * buckets).astype(np.int64), buckets - 1)
+    # Сортировка по (корзина, y): первая и последняя точка каждой корзины - ее минимум и максимум
+    order = positions[np.lexsort((ys[positions], bucket))]
+    sorted_bucket = np.sort(bucket)
+    starts = np.flatnonzero(np.r_[True, sorted_bucket[1:] != sorted_bucket[:-1]])
+    ends = np.r_[starts[1:], len(order)] - 1
+    return np.unique(np.concatenate([order[starts], order[ends]]))
+
+
+def window(x, start=None, end=None):
+    # Позиции точек отсортированного x внутри диапазона увеличения (с соседними точками по краям)
+    x = np.asarray(x)
+    lo = 0 if start is None else max(np.searchsorted(x, start, side='left') - 1, 0)
+    hi = len(x) if end is None else min(np.searchsorted(x, end, side='right') + 1, len(x))
+    return lo, hi
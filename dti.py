@@ -0,0 +1,112 @@
+import numpy as np
+import pandas as pd
+
+from amortization import BULLET, HORIZON_MONTHS, PERIOD_MONTHS, _month_number
+
+
+# Порог показателя долговой нагрузки (ПДН): доля дохода, уходящая на платежи по кредитам
+DTI_THRESHOLD = 0.5
+# Число вариантов дохода в сетке сценариев (шаги ползунка)
+INCOME_STEPS = 100
+
+
+# Ежемесячные обязательства по кредитам для расчета ПДН. Платеж кредита - среднемесячный платеж из выгрузки,
+# при его отсутствии - платеж по условиям (основной долг + проценты за период) или аннуитет по лимиту и ПСК.
+# Платеж действует с месяца после выдачи до закрытия (для закрытых - до даты основания прекращения).
+# Параметры кредитов считаются один раз при загрузке, ряд выборки - один проход bincount по ее кредитам.
+class DebtToIncome:
+    def __init__(self, df):
+        report_month = _month_number(df['reporting_dt'])
+        fund_month = _month_number(df['fund_date'])
+        close_month = _month_number(df['trade_close_dt'])
+        indicator_month = _month_number(df['loan_indicator_dt'])
+        closed = df['loan_indicator'].notna().to_numpy() & ~np.isnan(indicator_month)
+        end_month = np.where(closed, indicator_month, close_month)
+        # Бессрочные договоры и даты закрытия 2099-2260 годов ограничиваются горизонтом прогноза
+        horizon = np.where(np.isnan(report_month), fund_month, report_month) + HORIZON_MONTHS
+        end_month = np.where(np.isnan(end_month), horizon, np.minimum(end_month, horizon))
+
+        frequency = df['paymnt_condition_terms_frequency'].to_numpy(dtype=float)
+        term = np.maximum(end_month - fund_month, 1)
+        period = np.ones(len(df))
+        for code, months in PERIOD_MONTHS.items():
+            period[frequency == code] = months
+        period = np.where(frequency == BULLET, term, period)
+        terms_payment = (np.nan_to_num(df['paymnt_condition_principal_terms_amt'].to_numpy(dtype=float))
+                         + np.nan_to_num(df['paymnt_condition_interest_terms_amt'].to_numpy(dtype=float))) / period
+
+        limit = df['account_amt_credit_limit'].to_numpy(dtype=float)
+        rate = np.nan_to_num(df['overall_val_credit_total_amt'].to_numpy(dtype=float)) / 100 / 12
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            annuity = np.where(rate > 0, limit * rate / (1 - (1 + rate) ** -term), limit / term)
+        average = df['month_aver_paymt_aver_paymt_amt'].to_numpy(dtype=float)
+        payment = np.where(average > 0, average, np.where(terms_payment > 0, terms_payment, annuity))
+
+        valid = ~np.isnan(fund_month) & (end_month > fund_month) & (np.nan_to_num(payment) > 0)
+        self.rows = np.flatnonzero(valid)
+        self.size = len(df)
+        self.start = fund_month[valid].astype(np.int64) + 1  # первый месяц платежа
+        self.end = end_month[valid].astype(np.int64)
+        self.payment = payment[valid]
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in (self.rows, self.start, self.end, self.payment))
+
+    def obligations(self, positions=None):
+        # positions - позиции строк выборки в исходном df; None - весь портфель.
+        # Результат: сумма платежей по всем кредитам выборки в каждом календарном месяце.
+        if positions is None:
+            loans = np.arange(len(self.rows))
+        else:
+            selected = np.zeros(self.size, dtype=bool)
+            selected[positions] = True
+            loans = np.flatnonzero(selected[self.rows])
+        if len(loans) == 0:
+            return pd.Series([], index=pd.DatetimeIndex([]), dtype=float, name='obligations')
+
+        start, end, payment = self.start[loans], self.end[loans], self.payment[loans]
+        first = int(start.min())
+        length = int(end.max()) - first + 1
+        # Платеж добавляется в месяц начала и вычитается после месяца окончания, сумма - накопленным итогом
+        change = (np.bincount(start - first, weights=payment, minlength=length + 1)
+                  - np.bincount(end - first + 1, weights=payment, minlength=length + 1))
+        return pd.Series(np.round(np.cumsum(change)[:length], 2), name='obligations',
+                         index=pd.date_range(pd.Timestamp(year=first // 12, month=first % 12 + 1, day=1),
+                                             periods=length, freq='MS'))
+
+
+def _nice_step(value):
+    # Шаг сетки, округленный вверх до 1, 2 или 5 на степень десяти
+    if not value > 0:
+        return 1000.0
+    power = 10 ** np.floor(np.log10(value))
+    return float(next(factor * power for factor in (1, 2, 5, 10) if factor * power >= value))
+
+
+# Сценарии дохода для ряда обязательств: ПДН для всей сетки доходов считается одним broadcasting
+# (доходы x месяцы), ползунок дохода выбирает строку готовой матрицы без прохода по кредитам.
+# Сетка - до дохода, при котором пиковые платежи составляют половину порога.
+class IncomeScenarios:
+    def __init__(self, obligations, threshold=DTI_THRESHOLD, steps=INCOME_STEPS):
+        self.months = obligations.index
+        self.obligations = obligations.to_numpy(dtype=float)
+        self.threshold = threshold
+        peak = self.obligations.max() if len(self.obligations) else 0.0
+        self.step = _nice_step(2 * peak / threshold / steps)
+        self.incomes = self.step * np.arange(1, steps + 1)
+        self.dti = self.obligations[None, :] / self.incomes[:, None]
+        self.breaches = (self.dti > threshold).sum(axis=1)
+
+    @property
+    def empty(self):
+        return not self.obligations.any()
+
+    def index(self, income):
+        # Строка сетки для дохода (ползунок двигается шагами сетки)
+        return int(np.clip(np.rint(income / self.step) - 1, 0, len(self.incomes) - 1))
+
+    def safe_income(self):
+        # Наименьший доход сетки, при котором ПДН ни в одном месяце не выше порога
+        safe = np.flatnonzero(self.breaches == 0)
+        return float(self.incomes[safe[0]]) if len(safe) else None
@@ -0,0 +1,96 @@
+import json
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+import plotly.graph_objects as go
+import plotly.io as pio
+from plotly.colors import qualitative
+from plotly.io.json import to_json_plotly
+
+
+# Корпоративная цветовая схема
+corporate_colors = {
+    'background': '#F5F3FF',
+    'text': '#4B0082',
+    'colorscale': ['#7E5BEF', '#A389F4', '#C9B9FC', '#E5DEFF'],
+    'card': '#FFFFFF'
+}
+
+
+# Корпоративный шаблон plotly: оформление, которое раньше каждый колбэк задавал через update_layout.
+# Регистрируется один раз и применяется поверх стандартного шаблона ко всем фигурам (в том числе plotly.express).
+def register_template(name='corporate'):
+    pio.templates[name] = go.layout.Template(layout=dict(
+        font=dict(family='Verdana', color=corporate_colors['text']),
+        title=dict(font=dict(size=18, color='#5D3FBA')),
+        plot_bgcolor=corporate_colors['card'],
+        paper_bgcolor=corporate_colors['background'],
+        colorway=corporate_colors['colorscale'],
+        # Видов займов и целей больше четырех: круговые диаграммы - со стандартной палитрой plotly
+        # (первые 10 цветов как до шаблона), продолженной до 36 различимых цветов
+        piecolorway=qualitative.Plotly + qualitative.Alphabet,
+        colorscale=dict(sequential=corporate_colors['colorscale'])
+    ))
+    pio.templates.default = f'plotly+{name}'
+    _no_data_json.cache_clear()
+
+
+@lru_cache(maxsize=None)
+def _no_data_json(title):
+    import plotly.express as px  # plotly.express загружается при первой фигуре, а не при импорте
+
+    return px.scatter(title=title).to_json()
+
+
+# Заглушка для пустой выборки: строится один раз на заголовок, дальше отдается копия JSON
+def no_data_figure(title="Нет данных"):
+    return json.loads(_no_data_json(title))
+
+
+def _as_dict(figure):
+    # Заглушки no_data_figure уже словари
+    return figure if isinstance(figure, dict) else figure.to_plotly_json()
+
+
+# Кэш готовых фигур: JSON фигуры по ключу (id графика, ключ выборки, версии данных).
+# Повторный выбор тех же фильтров отдает фигуру без пересчета данных и вызовов plotly, вытеснение - LRU по объему.
+class FigureCache:
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._items = OrderedDict()  # key -> JSON фигуры (или списка фигур)
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_build(self, key, build):
+        # build() возвращает фигуру или список фигур (для колбэков с несколькими графиками)
+        with self._lock:
+            blob = self._items.get(key)
+            if blob is not None:
+                self._items.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+        if blob is None:
+            built = build()
+            if isinstance(built, (list, tuple)):
+                blob = to_json_plotly([_as_dict(figure) for figure in built])
+            else:
+                blob = to_json_plotly(_as_dict(built))
+            self._put(key, blob)
+        # Колбэк получает свою копию фигуры, Dash принимает словари вместо go.Figure
+        return json.loads(blob)
+
+    def _put(self, key, blob):
+        if len(blob) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._items:
+                self._size -= len(self._items.pop(key))
+            self._items[key] = blob
+            self._size += len(blob)
+            while self._size > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self._size -= len(evicted)
@@ -0,0 +1,33 @@
+import numpy as np
+
+
+# Индекс фильтров: для каждого измерения хранит позиции строк по каждому значению.
+# Строится один раз при загрузке, выборка - пересечение массивов позиций.
+class FilterIndex:
+    def __init__(self, df, columns):
+        self.size = len(df)
+        self._positions = {}
+        for column in columns:
+            # groupby().indices возвращает отсортированные позиции строк для каждого значения
+            self._positions[column] = {
+                key: positions.astype(np.int64)
+                for key, positions in df.groupby(column, sort=False, observed=True).indices.items()
+            }
+
+    def values(self, column):
+        return list(self._positions[column].keys())
+
+    def positions(self, column, value):
+        return self._positions[column].get(value, np.empty(0, dtype=np.int64))
+
+    def select(self, conditions):
+        # conditions - список пар (колонка, значение); None означает «все строки»
+        if not conditions:
+            return None
+        arrays = sorted((self.positions(column, value) for column, value in conditions), key=len)
+        result = arrays[0]
+        for positions in arrays[1:]:
+            if result.size == 0:
+                break
+            result = np.intersect1d(result, positions, assume_unique=True)
+        return result
@@ -0,0 +1,61 @@
+import threading
+import time
+
+
+# Общий для процесса клиент GigaChat: одно HTTP-соединение (пул httpx) и один токен доступа
+# на все колбэки Dash. Токен обновляется заранее, до истечения срока действия.
+# Адреса API и авторизации берутся из аргументов или переменных GIGACHAT_BASE_URL / GIGACHAT_AUTH_URL,
+# поэтому клиент можно направить на локальный сервер-заглушку.
+class GigaChatPool:
+    def __init__(self, credentials, refresh_margin=120, **settings):
+        self.credentials = credentials
+        self.refresh_margin = refresh_margin  # секунды до истечения токена, когда пора обновлять
+        self.settings = {'verify_ssl_certs': False, **settings}
+        self._client = None
+        self._lock = threading.Lock()
+        self.requests = 0
+        # Повторные использования общего клиента; реальные TCP-соединения считает сервер (см. giga_stub.py)
+        self.client_reuses = 0
+        self.token_refreshes = 0
+        self.errors = 0
+
+    def _get_client(self):
+        with self._lock:
+            self.requests += 1
+            if self._client is None:
+                from gigachat import GigaChat
+                self._client = GigaChat(credentials=self.credentials, **self.settings)
+            else:
+                self.client_reuses += 1
+            if self.credentials and self._token_expiring():
+                self._client._access_token = None
+                self._client.get_token()
+                self.token_refreshes += 1
+            return self._client
+
+    # _access_token и сброс токена - внутренности gigachat, проверены на версии из requirements.txt (0.2.3)
+    def _token_expiring(self):
+        token = self._client._access_token
+        if token is None:
+            return True
+        # expires_at приходит в миллисекундах, 0 - бессрочный токен
+        return token.expires_at != 0 and token.expires_at / 1000 - time.time() < self.refresh_margin
+
+    def chat(self, prompt):
+        try:
+            return self._get_client().chat(prompt).choices[0].message.content
+        except Exception:
+            with self._lock:
+                self.errors += 1
+            raise
+
+    def stats(self):
+        with self._lock:
+            return {'requests': self.requests, 'client_reuses': self.client_reuses,
+                    'token_refreshes': self.token_refreshes, 'errors': self.errors}
+
+    def close(self):
+        with self._lock:
+            if self._client is not None:
+                self._client.close()
+                self._client = None
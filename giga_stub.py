@@ -0,0 +1,121 @@
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# Локальная заглушка API GigaChat (OAuth + chat/completions) для проверки GigaChatPool без сети.
+# Сервер считает обмены токена, запросы чата и TCP-соединения: соединение переиспользуется,
+# если запросов больше, чем соединений.
+class GigaChatStub:
+    def __init__(self, host='127.0.0.1', port=0, token_lifetime=1800, answer="Ответ заглушки"):
+        self.token_lifetime = token_lifetime
+        self.answer = answer
+        self.counts = {'token_exchanges': 0, 'chat_requests': 0, 'connections': 0}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        return f'http://{self._server.server_address[0]}:{self._server.server_address[1]}/api/v1'
+
+    @property
+    def auth_url(self):
+        return f'http://{self._server.server_address[0]}:{self._server.server_address[1]}/api/v2/oauth'
+
+    def _count(self, name):
+        with self._lock:
+            self.counts[name] += 1
+            return self.counts[name]
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # keep-alive: соединение живет между запросами
+
+            def setup(self):
+                super().setup()
+                stub._count('connections')  # вызывается один раз на TCP-соединение
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                if self.path.endswith('/oauth'):
+                    number = stub._count('token_exchanges')
+                    body = {'access_token': f'token-{number}',
+                            'expires_at': int((time.time() + stub.token_lifetime) * 1000)}
+                else:
+                    stub._count('chat_requests')
+                    body = {'choices': [{'message': {'role': 'assistant', 'content': stub.answer}, 'index': 0,
+                                         'finish_reason': 'stop'}],
+                            'created': int(time.time()), 'model': 'GigaChat', 'object': 'chat.completion',
+                            'usage': {'prompt_tokens': 1, 'completion_tokens': 1, 'total_tokens': 2}}
+                payload = json.dumps(body, ensure_ascii=False).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='gigachat-stub', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+# Проверка пула: параллельные запросы через один клиент против заглушки.
+# Долгоживущий токен - один обмен на все запросы и соединений не больше, чем потоков;
+# токен короче запаса обновления - обмен перед каждым запросом.
+def check(requests=20, threads=8, token_lifetime=1800):
+    from giga_client import GigaChatPool
+
+    stub = GigaChatStub(token_lifetime=token_lifetime).start()
+    try:
+        pool = GigaChatPool('Y3JlZGVudGlhbHM=', base_url=stub.base_url, auth_url=stub.auth_url, model='GigaChat')
+        with ThreadPoolExecutor(threads) as executor:
+            answers = list(executor.map(pool.chat, ["Проверка"] * requests))
+        pool.close()
+    finally:
+        stub.stop()
+    result = {'pool': pool.stats(), 'server': dict(stub.counts)}
+    expected_exchanges = 1 if token_lifetime > pool.refresh_margin else requests
+    problems = []
+    if answers != [stub.answer] * requests or stub.counts['chat_requests'] != requests:
+        problems.append("не все запросы получили ответ заглушки")
+    if stub.counts['token_exchanges'] != expected_exchanges:
+        problems.append(f"обменов токена {stub.counts['token_exchanges']}, ожидалось {expected_exchanges}")
+    if stub.counts['connections'] > threads + stub.counts['token_exchanges']:
+        problems.append(f"соединений {stub.counts['connections']}: соединения не переиспользуются")
+    result['problems'] = problems
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Проверка GigaChatPool против локальной заглушки API")
+    parser.add_argument('--requests', type=int, default=20)
+    parser.add_argument('--threads', type=int, default=8)
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    failed = False
+    # 90 с - внутри запаса пула (120 с), но вне собственного запаса gigachat (60 с)
+    for lifetime in (1800, 90):
+        result = check(args.requests, args.threads, lifetime)
+        print(f"токен {lifetime} с: {json.dumps(result, ensure_ascii=False)}")
+        failed |= bool(result['problems'])
+    sys.exit(1 if failed else 0)
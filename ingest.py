@@ -0,0 +1,104 @@
+import argparse
+import os
+import resource
+import sys
+import time
+
+import pandas as pd
+
+from agg_cube import DIMENSIONS, AggregateCube
+from dataset import prepare_loans
+from schema import apply_schema, read_loans
+
+
+ARREAR_COLUMNS = ['client_id', 'account_uid', 'arrear_amt_outstanding', 'arrear_calc_date', 'due_arrear_start_dt',
+                  'past_due_amt_past_due', 'overall_val_credit_total_amt']
+
+
+def peak_rss_mb():
+    # ru_maxrss в Linux - в килобайтах
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+# Потоковое чтение выгрузки бюро кусками ограниченного размера с расшифровкой кодов в каждом куске
+def iter_chunks(path, mapping_tables, chunksize=200_000):
+    for chunk in read_loans(path, chunksize):
+        yield prepare_loans(chunk, mapping_tables)
+
+
+# Накопительные агрегаты по всей выгрузке: куб KPI/статистики по годам и строки с задолженностью.
+# Размер состояния зависит от числа годов/валют/клиентов, а не от числа строк: строки с задолженностью
+# дописываются в файл arrears_path (без него считается только их число).
+class RunningAggregates:
+    def __init__(self, arrears_path=None):
+        self.cells = None
+        self.arrears_path = arrears_path
+        self.arrear_rows = 0
+        if arrears_path and os.path.exists(arrears_path):
+            os.remove(arrears_path)
+
+    def update(self, chunk):
+        cells = AggregateCube(chunk).cells
+        if self.cells is not None:
+            cells = (pd.concat([self.cells, cells])
+                     .groupby(DIMENSIONS, dropna=False, observed=True, as_index=False).sum())
+        self.cells = cells
+        arrears = chunk.loc[chunk['arrear_sign'] == 1, ARREAR_COLUMNS]
+        if self.arrears_path and len(arrears):
+            # Первый кусок - с заголовком; даты пишутся в формате выгрузки
+            arrears.to_csv(self.arrears_path, sep=';', index=False, mode='a', header=not self.arrear_rows)
+        self.arrear_rows += len(arrears)
+
+    def totals(self):
+        return AggregateCube.totals(self.cells)
+
+    def year_stats(self):
+        return AggregateCube.rollup(self.cells, 'year')
+
+    def arrears(self):
+        # Строки с задолженностью читаются из файла целиком - только по запросу
+        if not self.arrears_path or not self.arrear_rows:
+            return pd.DataFrame(columns=ARREAR_COLUMNS)
+        return apply_schema(read_loans(self.arrears_path))
+
+
+# Один проход по файлу: каждый кусок отдается потребителям (consumers) и в накопительные агрегаты.
+# aggregates=False - только потребители (агрегаты не считаются и не возвращаются)
+def ingest(path, mapping_tables, chunksize=200_000, consumers=(), aggregates=True, arrears_path=None):
+    aggregates = RunningAggregates(arrears_path) if aggregates else None
+    started = time.perf_counter()
+    rows = chunks = 0
+    for chunk in iter_chunks(path, mapping_tables, chunksize):
+        if aggregates is not None:
+            aggregates.update(chunk)
+        for consumer in consumers:
+            consumer(chunks, chunk)
+        rows += len(chunk)
+        chunks += 1
+    seconds = time.perf_counter() - started
+    report = {
+        'rows': rows,
+        'chunks': chunks,
+        'seconds': round(seconds, 3),
+        'rows_per_second': round(rows / seconds) if seconds else rows,
+        'peak_rss_mb': round(peak_rss_mb(), 1)
+    }
+    return aggregates, report
+
+
+if __name__ == '__main__':
+    from mapping_registry import MappingRegistry
+
+    parser = argparse.ArgumentParser(description="Потоковая загрузка выгрузки бюро")
+    parser.add_argument('path')
+    parser.add_argument('--mapping', default="maping_csv.csv")
+    parser.add_argument('--chunksize', type=int, default=200_000)
+    parser.add_argument('--arrears', help="Файл для строк с задолженностью (по умолчанию - только их число)")
+    args = parser.parse_args()
+
+    aggregates, report = ingest(args.path, MappingRegistry(args.mapping).get(), args.chunksize,
+                                arrears_path=args.arrears)
+    print(aggregates.totals())
+    print(aggregates.year_stats()[['year', 'rows', 'account_amt_credit_limit_sum']].to_string(index=False))
+    print(f"Строк с задолженностью: {aggregates.arrear_rows}")
+    print(report, file=sys.stderr)
@@ -1,29 +1,177 @@
-import requests
-from datetime import datetime
-
-
-def get_cbr_key_rate():
-    try:
-        # Официальное API ЦБ РФ
-        url = "https://www.cbr.ru/scripts/XML_dynamic.asp?date_req1=01/01/2023&date_req2=31/12/2024&VAL_NM_RQ=R01235"
-        response = requests.get(url)
-        response.raise_for_status()
-
-        # Парсинг XML (пример, актуальный парсинг зависит от структуры ответа)
-        from bs4 import BeautifulSoup
-        soup = BeautifulSoup(response.content, 'xml')
-        last_record = soup.find_all('Record')[-1]
-        rate = last_record.Value.text.strip()
-        date = last_record['Date']
-
-        return {
-            'rate': float(rate.replace(',', '.')),
-            'date': datetime.strptime(date, '%d.%m.%Y').strftime('%d.%m.%Y')
-        }
-    except Exception as e:
-        print(f"Ошибка получения ставки: {str(e)}")
-        return {'rate': 'Н/Д', 'date': 'Н/Д'}
-
-rate_data = get_cbr_key_rate()
-
-print(rate_data)
\ No newline at end of file
+import os
+import sys
+import threading
+import time
+import xml.etree.ElementTree as ET
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+from storage import file_lock
+
+
+# Веб-сервис ЦБ РФ: ключевая ставка за период (ответ - XML с записями <KR><DT/><Rate/></KR>)
+KEY_RATE_URL = "https://www.cbr.ru/DailyInfoWebServ/DailyInfo.asmx/KeyRateXML"
+# Ключевая ставка введена 13.09.2013, раньше запрашивать нечего
+FIRST_DATE = date(2013, 9, 13)
+
+
+def _local_name(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+# Потоковый разбор ответа: записи обрабатываются по мере чтения и сразу удаляются из дерева
+def parse_key_rate_xml(source):
+    records = []
+    for _, element in ET.iterparse(source, events=('end',)):
+        if _local_name(element.tag) != 'KR':
+            continue
+        fields = {_local_name(child.tag): (child.text or '').strip() for child in element}
+        if fields.get('DT') and fields.get('Rate'):
+            records.append((fields['DT'][:10], float(fields['Rate'].replace(',', '.'))))
+        element.clear()
+    return records
+
+
+def fetch_key_rates(start, end, timeout=10):
+    import requests  # сеть нужна только фоновому обновлению, не запуску приложения
+
+    response = requests.get(KEY_RATE_URL, params={'fromDate': start.isoformat(), 'ToDate': end.isoformat()},
+                            timeout=timeout, stream=True)
+    response.raise_for_status()
+    response.raw.decode_content = True
+    return parse_key_rate_xml(response.raw)
+
+
+def _read_store(path):
+    frame = pd.read_csv(path, delimiter=';', parse_dates=['date'])
+    return frame['date'].to_numpy(dtype='datetime64[D]'), frame['rate'].to_numpy(dtype=float)
+
+
+# Сервис ключевой ставки: локальный ряд на диске, в памяти - отсортированные массивы для поиска «на дату».
+# Из сети догружаются только недостающие даты, обновление идет в фоновом потоке, чтение никогда не ждет сеть.
+# Без сети работает по последним сохраненным значениям или по файлу-фикстуре с датами изменения ставки.
+class KeyRateService:
+    def __init__(self, store_path='key_rate.csv', fixture_path='key_rate_fixture.csv', refresh_interval=6 * 3600):
+        self.store_path = store_path
+        self.fixture_path = fixture_path
+        self.refresh_interval = refresh_interval
+        self.source = 'none'
+        self.updated_at = None
+        self.last_error = None
+        self._dates = np.array([], dtype='datetime64[D]')
+        self._rates = np.array([], dtype=float)
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        for path, source in ((store_path, 'store'), (fixture_path, 'fixture')):
+            try:
+                self._dates, self._rates = _read_store(path)
+                self.source = source
+                break
+            except (OSError, ValueError, KeyError):
+                continue
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='key-rate-refresh', daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                # Поток обновления не должен умирать: следующая попытка - через refresh_interval
+                self.last_error = str(e)
+                print(f"Ошибка обновления ставки: {e}", file=sys.stderr)
+            self._wakeup.wait(self.refresh_interval)
+            self._wakeup.clear()
+
+    def missing_ranges(self, today=None):
+        # Диапазоны дат, которых нет в локальном ряду: до первой сохраненной даты и после последней
+        today = today or date.today()
+        if not len(self._dates):
+            return [(FIRST_DATE, today)]
+        first = self._dates[0].astype(date)
+        last = self._dates[-1].astype(date)
+        ranges = []
+        if first > FIRST_DATE:
+            ranges.append((FIRST_DATE, first - timedelta(days=1)))
+        if last < today:
+            ranges.append((last + timedelta(days=1), today))
+        return ranges
+
+    def refresh(self):
+        import requests
+
+        records = []
+        try:
+            for start, end in self.missing_ranges():
+                records.extend(fetch_key_rates(start, end))
+        except (requests.RequestException, ET.ParseError, ValueError) as e:
+            self.last_error = str(e)
+            print(f"Ошибка получения ставки: {e}", file=sys.stderr)
+        if records:
+            self._merge(records)
+        self.updated_at = time.time()
+
+    def _merge(self, records):
+        # Каждый воркер gunicorn обновляет ряд сам: запись - под блокировкой файла, во временный файл процесса
+        with file_lock(self.store_path + '.lock'):
+            try:
+                dates, rates = _read_store(self.store_path)  # другой воркер мог уже дописать ряд
+            except (OSError, ValueError, KeyError):
+                dates, rates = self._dates, self._rates
+            frame = pd.DataFrame({'date': np.concatenate([dates, np.array([r[0] for r in records],
+                                                                          dtype='datetime64[D]')]),
+                                  'rate': np.concatenate([rates, [r[1] for r in records]])})
+            frame = frame.drop_duplicates('date', keep='last').sort_values('date')
+            tmp_path = f'{self.store_path}.{os.getpid()}.tmp'
+            frame.to_csv(tmp_path, sep=';', index=False)
+            os.replace(tmp_path, self.store_path)
+        with self._lock:
+            self._dates = frame['date'].to_numpy(dtype='datetime64[D]')
+            self._rates = frame['rate'].to_numpy(dtype=float)
+            self.source = 'cbr'
+
+    def rate_on(self, day):
+        # Ставка, действовавшая на дату (последнее значение не позже даты), None - если дата раньше ряда
+        with self._lock:
+            dates, rates = self._dates, self._rates
+        position = np.searchsorted(dates, np.datetime64(pd.Timestamp(day).date(), 'D'), side='right') - 1
+        return float(rates[position]) if position >= 0 else None
+
+    def latest(self):
+        with self._lock:
+            dates, rates = self._dates, self._rates
+        if not len(dates):
+            return {'rate': 'Н/Д', 'date': 'Н/Д', 'source': self.source}
+        return {'rate': float(rates[-1]), 'date': dates[-1].astype(date).strftime('%d.%m.%Y'), 'source': self.source}
+
+    def series(self, start=None, end=None):
+        # Ступенчатый ряд ставки за период: значение на начало периода и все изменения внутри него
+        with self._lock:
+            frame = pd.DataFrame({'date': pd.to_datetime(self._dates), 'rate': self._rates})
+        changed = frame['rate'].ne(frame['rate'].shift())
+        frame = frame[changed]
+        if start is not None:
+            start = pd.Timestamp(start)
+            before = frame[frame['date'] <= start].tail(1).assign(date=start)
+            frame = frame[frame['date'] > start]
+            # Период начинается раньше ряда - значения на начало нет (пустой кадр в concat дает FutureWarning)
+            if len(before):
+                frame = pd.concat([before, frame])
+        end = pd.Timestamp(end) if end is not None else pd.Timestamp(date.today())
+        frame = frame[frame['date'] <= end]
+        if len(frame):
+            frame = pd.concat([frame, frame.tail(1).assign(date=end)])
+        return frame.reset_index(drop=True)
+
+
+if __name__ == '__main__':
+    service = KeyRateService()
+    service.refresh()
+    print(service.latest())
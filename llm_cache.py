@@ -0,0 +1,84 @@
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from storage import sqlite_connection
+
+
+# Нормализованный отпечаток запроса: пробелы и переносы строк не влияют на ключ
+def prompt_key(*parts):
+    normalized = "\x1f".join(re.sub(r"\s+", " ", str(part)).strip() for part in parts)
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+# Кэш ответов LLM: LRU в памяти процесса + SQLite на диске, общий для всех воркеров gunicorn
+class LLMCache:
+    def __init__(self, path="llm_cache.sqlite3", ttl=24 * 3600, max_items=256):
+        self.path = path
+        self.ttl = ttl
+        self.max_items = max_items
+        self._memory = OrderedDict()  # key -> (время записи, ответ)
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        with sqlite_connection(self.path) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS responses "
+                         "(key TEXT PRIMARY KEY, response TEXT NOT NULL, created REAL NOT NULL)")
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            item = self._memory.get(key)
+            if item is not None and now - item[0] <= self.ttl:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return item[1]
+        try:
+            with sqlite_connection(self.path) as conn:
+                row = conn.execute("SELECT response, created FROM responses WHERE key = ? AND created >= ?",
+                                   (key, now - self.ttl)).fetchone()
+        except sqlite3.Error:
+            row = None
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._remember(key, row[1], row[0])
+        return row[0]
+
+    def put(self, key, response):
+        now = time.time()
+        with self._lock:
+            self._remember(key, now, response)
+        try:
+            with sqlite_connection(self.path) as conn:
+                conn.execute("INSERT OR REPLACE INTO responses (key, response, created) VALUES (?, ?, ?)",
+                             (key, response, now))
+                # Заодно чистим просроченные записи
+                conn.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+        except sqlite3.Error:
+            pass  # Дисковый уровень необязателен, ответ остается в памяти
+
+    def get_or_compute(self, key, compute):
+        response = self.get(key)
+        if response is None:
+            response = compute()  # Ошибки не кэшируются
+            self.put(key, response)
+        return response
+
+    def stats(self):
+        with self._lock:
+            return {'memory_hits': self.memory_hits, 'disk_hits': self.disk_hits,
+                    'misses': self.misses, 'memory_items': len(self._memory)}
+
+    def _remember(self, key, created, response):
+        self._memory[key] = (created, response)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_items:
+            self._memory.popitem(last=False)
@@ -0,0 +1,117 @@
+import math
+import re
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+
+# Колонки, которые идут в контекст, если вопрос не совпал ни с одним описанием
+DEFAULT_COLUMNS = ['account_amt_credit_limit', 'overall_val_credit_total_amt', 'overall_val_credit_total_monetary_amt',
+                   'loan_indicator', 'fund_date', 'arrear_amt_outstanding', 'past_due_amt_past_due']
+
+
+def _stems(text):
+    # Грубая нормализация русских словоформ: первые 5 букв слова
+    return {word[:5] for word in re.findall(r"[a-zа-яё0-9]+", str(text).lower()) if len(word) >= 3}
+
+
+def estimate_tokens(text):
+    # Оценка без токенизатора: ~3 символа кириллицы на токен
+    return len(text) // 3 + 1
+
+
+def _format_number(value):
+    return f"{value:,.2f}".rstrip('0').rstrip('.') if pd.notna(value) else "н/д"
+
+
+# Сборщик контекста для свободного вопроса: выбирает колонки, релевантные вопросу,
+# по описаниям из реестра справочника и отдает компактные агрегаты вместо строк датафрейма
+# в пределах бюджета токенов. Агрегаты кэшируются по отпечатку выборки.
+class ContextBuilder:
+    def __init__(self, registry, token_budget=1500, max_columns=12, cache_size=32):
+        self.registry = registry
+        self.token_budget = token_budget
+        self.max_columns = max_columns
+        self.cache_size = cache_size
+        self._version = None
+        self._summaries = OrderedDict()  # отпечаток выборки -> {колонка: строка сводки}
+        self._lock = threading.Lock()
+
+    def _refresh(self):
+        # Справочник изменился - пересчитываем веса слов и сбрасываем сводки
+        tables = self.registry.get()
+        with self._lock:
+            if self._version == self.registry.version:
+                return tables
+            self._column_stems = {column: _stems(column.replace('_', ' ')) | _stems(description)
+                                  for column, description in tables.descriptions.items()}
+            # Редкие слова описаний весят больше частых
+            document_frequency = {}
+            for stems in self._column_stems.values():
+                for stem in stems:
+                    document_frequency[stem] = document_frequency.get(stem, 0) + 1
+            total = len(self._column_stems)
+            self._idf = {stem: math.log(1 + total / count) for stem, count in document_frequency.items()}
+            self._summaries.clear()
+            self._version = self.registry.version
+        return tables
+
+    def relevant_columns(self, question, columns):
+        self._refresh()
+        question_stems = _stems(question)
+        scores = {}
+        for column in columns:
+            score = sum(self._idf.get(stem, 0) for stem in question_stems & self._column_stems.get(column, set()))
+            if score > 0:
+                scores[column] = score
+        if not scores:
+            return [column for column in DEFAULT_COLUMNS if column in columns]
+        return sorted(scores, key=scores.get, reverse=True)[:self.max_columns]
+
+    def build(self, question, df, fingerprint):
+        tables = self._refresh()
+        columns = self.relevant_columns(question, list(df.columns))
+        summaries = self._cached_summaries(fingerprint)
+        lines = [f"Кредитов в выборке: {len(df)}"]
+        used = estimate_tokens(lines[0])
+        for column in columns:
+            with self._lock:
+                line = summaries.get(column)
+            if line is None:
+                line = self._summarize(tables.title(column), column, df[column])
+                with self._lock:
+                    summaries[column] = line
+            cost = estimate_tokens(line)
+            if used + cost > self.token_budget:
+                break
+            lines.append(line)
+            used += cost
+        return "\n".join(lines)
+
+    def _cached_summaries(self, fingerprint):
+        with self._lock:
+            summaries = self._summaries.get(fingerprint)
+            if summaries is None:
+                summaries = self._summaries[fingerprint] = {}
+            self._summaries.move_to_end(fingerprint)
+            while len(self._summaries) > self.cache_size:
+                self._summaries.popitem(last=False)
+            return summaries
+
+    def _summarize(self, title, column, series):
+        name = f"- {title} ({column})"
+        filled = int(series.notna().sum())
+        if filled == 0:
+            return f"{name}: нет данных"
+        if column.endswith(('_id', '_uid')):
+            return f"{name}: {series.nunique()} различных значений"
+        if pd.api.types.is_datetime64_any_dtype(series):
+            return f"{name}: с {series.min():%d.%m.%Y} по {series.max():%d.%m.%Y}, заполнено {filled}"
+        # Флаги и коды с несколькими значениями описываем распределением, а не суммой
+        if pd.api.types.is_numeric_dtype(series) and series.nunique() > 5:
+            return (f"{name}: сумма {_format_number(series.sum())}, среднее {_format_number(series.mean())}, "
+                    f"мин {_format_number(series.min())}, макс {_format_number(series.max())}, заполнено {filled}")
+        top = series.value_counts().head(5)
+        values = ", ".join(f"{value} - {count}" for value, count in top.items())
+        return f"{name}: {series.nunique()} различных значений, чаще всего: {values}"
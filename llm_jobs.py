@@ -0,0 +1,72 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from storage import sqlite_connection
+
+
+# Фоновые задания для запросов к LLM: колбэк получает id задания сразу,
+# страница опрашивает результат через dcc.Interval.
+# Статус и ответ пишутся в SQLite (тот же файл, что у кэша ответов): опрос может прийти
+# в любой воркер gunicorn, а не только в тот, что запустил задание.
+class LLMJobs:
+    def __init__(self, path="llm_cache.sqlite3", max_workers=4, ttl=3600):
+        self.path = path
+        self.ttl = ttl  # задания старше удаляются, даже если результат так и не запросили
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='llm')
+        self._running = {}  # job_id -> future, только пока задание выполняется в этом процессе
+        self._lock = threading.Lock()
+        with sqlite_connection(self.path) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS jobs "
+                         "(job_id TEXT PRIMARY KEY, status TEXT NOT NULL, result TEXT, created REAL NOT NULL)")
+
+    def submit(self, fn, *args, replaces=None):
+        # Предыдущее задание той же страницы устарело: отменяем его или просто забываем результат
+        if replaces:
+            self.cancel(replaces)
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with sqlite_connection(self.path) as conn:
+            conn.execute("INSERT INTO jobs (job_id, status, created) VALUES (?, 'pending', ?)", (job_id, now))
+            # Заодно удаляем задания, результат которых так и не забрали (страницу закрыли)
+            conn.execute("DELETE FROM jobs WHERE created < ?", (now - self.ttl,))
+        with self._lock:
+            future = self._running[job_id] = self._executor.submit(self._run, job_id, fn, *args)
+        future.add_done_callback(lambda _: self._forget(job_id))
+        return job_id
+
+    def _run(self, job_id, fn, *args):
+        try:
+            result = fn(*args)
+        except Exception as e:
+            result = f"Ошибка: {str(e)}"  # иначе задание осталось бы 'pending' до истечения ttl
+        with sqlite_connection(self.path) as conn:
+            # Отмененное задание (строки уже нет) не воскрешается
+            conn.execute("UPDATE jobs SET status = 'done', result = ? WHERE job_id = ?", (result, job_id))
+
+    def _forget(self, job_id):
+        with self._lock:
+            self._running.pop(job_id, None)
+
+    def cancel(self, job_id):
+        with self._lock:
+            future = self._running.pop(job_id, None)
+        if future is not None:
+            future.cancel()  # Уже запущенный запрос не прерывается, его ответ будет отброшен
+        with sqlite_connection(self.path) as conn:
+            conn.execute("DELETE FROM jobs WHERE job_id = ?", (job_id,))
+
+    def poll(self, job_id):
+        # Возвращает (статус, результат): 'pending', 'done' или 'unknown'.
+        # Готовый ответ не удаляется при чтении: повторный опрос (второй тик Interval, вкладка, повтор запроса)
+        # получает тот же ответ. Строка удаляется по ttl или когда страница заменяет задание (submit/cancel)
+        with sqlite_connection(self.path) as conn:
+            row = conn.execute("SELECT status, result, created FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None or time.time() - row[2] > self.ttl:
+            # Нет задания или воркер, который его выполнял, перезапущен
+            return 'unknown', None
+        if row[0] == 'pending':
+            return 'pending', None
+        return 'done', row[1]
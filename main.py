@@ -1,272 +1,628 @@
 import dash
-from dash import dcc, html, Input, Output, callback, State
-import plotly.express as px
+from dash import dcc, html, Input, Output, callback, State, Patch
 import pandas as pd
 from datetime import datetime
 from dash import dash_table
 import plotly.graph_objects as go
-from gigachat import GigaChat
+import numpy as np
 from dotenv import load_dotenv
 import os
+import sys
+import threading
+import time
+from functools import lru_cache
+from flask import Response, request
+from plotly.io.json import to_json_plotly
+from result_cache import ResultCache, selection_key
+from llm_jobs import LLMJobs
+from llm_cache import LLMCache, prompt_key
+from giga_client import GigaChatPool
+from llm_context import ContextBuilder
+from mapping_registry import MappingRegistry
+from dataset import Dataset
+from partition_store import PartitionStore
+from payment_history import PaymentHistory
+from key_rate import KeyRateService
+from table_query import query_table
+from dti import IncomeScenarios
+from downsample import THRESHOLD, lttb, minmax_buckets, window
+from figures import FigureCache, corporate_colors, no_data_figure, register_template
+from metrics import Metrics
+from snapshot import ColumnarSnapshot, memory_report
+from schema import LOAN_COLUMNS
+from risk_features import load_risk_features, read_risk_features
 
 
 load_dotenv()
 
-client_file_path = "client_5.csv"
+client_file_path = os.getenv('CLIENT_FILE_PATH', "client_5.csv")
 mapping_file_path = "maping_csv.csv"
 giga_token = os.getenv('TOKEN_GIGA')
-# Чтение файлов
-df = pd.read_csv(client_file_path, delimiter=';',
-                         parse_dates=["fund_date", "trade_close_dt", "loan_indicator_dt"], encoding="utf-8")
-mapping_df = pd.read_csv(mapping_file_path, delimiter=';')
+# Справочник разбирается один раз, перечитывается только при изменении файла
+mapping_registry = MappingRegistry(mapping_file_path)
+
+# Подготовленная выгрузка (коды расшифрованы, год выдачи) берется из снимка колонок на диске:
+# воркеры gunicorn отображают его в память и делят страницы, CSV разбирается только при изменении.
+# В рабочей таблице - только колонки, которые читают графики и индексы (schema.PROJECTIONS)
+snapshot = ColumnarSnapshot(client_file_path, mapping_registry, directory=os.getenv('SNAPSHOT_DIR', 'snapshot'))
+df = snapshot.load(LOAN_COLUMNS)
+
+# Индекс фильтров, события задолженности и куб агрегатов строятся один раз, при первом обращении
+portfolio = Dataset(df, snapshot)
+
+# Выгрузка, разбитая по клиентам: раздел клиента читается с диска только при его выборе
+partition_store = PartitionStore(os.getenv('PARTITION_SOURCE', client_file_path), mapping_registry,
+                                 directory=os.getenv('PARTITION_DIR', 'partitions'),
+                                 max_bytes=int(os.getenv('PARTITION_CACHE_BYTES', 512 * 1024 * 1024)))
+# Кэш ответов GigaChat (память + SQLite, общий для воркеров)
+llm_cache = LLMCache(os.getenv('LLM_CACHE_PATH', 'llm_cache.sqlite3'), ttl=24 * 3600)
+# Пул фоновых запросов к GigaChat; статус заданий - в том же SQLite, опрос отвечает любой воркер
+llm_jobs = LLMJobs(llm_cache.path, max_workers=4)
+# Долгоживущий клиент GigaChat: соединение и токен переиспользуются между запросами
+giga_pool = GigaChatPool(giga_token)
+
+# Ключевая ставка ЦБ: читается из локального ряда, догружается из сети в фоне
+key_rate_service = KeyRateService(os.getenv('KEY_RATE_STORE', 'key_rate.csv')).start()
+# Контекст свободных вопросов по описаниям колонок из справочника
+context_builder = ContextBuilder(mapping_registry,
+                                 token_budget=int(os.getenv('LLM_CONTEXT_TOKENS', 1500)))
+
+# Серверный кэш выборок: в Store передается только ключ и состояние фильтров,
+# на сервере по ключу хранятся позиции строк выборки (сами строки берутся из рабочей таблицы)
+result_cache = ResultCache(max_bytes=256 * 1024 * 1024, ttl=600)
+
+# Оформление графиков задается корпоративным шаблоном, готовые фигуры кэшируются по выборке
+register_template()
+figure_cache = FigureCache(max_bytes=int(os.getenv('FIGURE_CACHE_BYTES', 64 * 1024 * 1024)))
+
+# Метрики колбэков и LLM для Prometheus; профилирование запроса по заголовку X-Profile: 1,
+# если задана папка PROFILE_DIR
+metrics = Metrics(profile_dir=os.getenv('PROFILE_DIR'))
+
+
+def runtime_metrics():
+    # Счетчики кэшей и клиента GigaChat снимаются в момент запроса /metrics
+    values = [('result_cache_hits_total', 'counter', "Попадания в кэш выборок", {}, result_cache.hits),
+              ('result_cache_misses_total', 'counter', "Промахи кэша выборок", {}, result_cache.misses),
+              ('figure_cache_hits_total', 'counter', "Попадания в кэш фигур", {}, figure_cache.hits),
+              ('figure_cache_misses_total', 'counter', "Промахи кэша фигур", {}, figure_cache.misses)]
+    for name, value in llm_cache.stats().items():
+        values.append((f'llm_cache_{name}', 'gauge', "Кэш ответов GigaChat", {}, value))
+    for name, value in giga_pool.stats().items():
+        values.append((f'gigachat_{name}_total', 'counter', "Клиент GigaChat", {}, value))
+    # Память воркера: своя (анонимная) и страницы отображенного снимка, общие для воркеров
+    for name, value in memory_report().items():
+        values.append(('worker_memory_mb', 'gauge', "Память процесса воркера", {'kind': name}, value))
+    values.append(('snapshot_mapped_bytes', 'gauge', "Объем отображенного снимка данных", {}, snapshot.nbytes))
+    return values
+
+
+metrics.add_collector(runtime_metrics)
+
+
+def llm_chat(kind, prompt):
+    with metrics.llm_call(kind):
+        return giga_pool.chat(prompt)
+
+
+# Разбиение по клиентам и признаки риска (пул процессов по шардам клиентов) готовятся в фоне при запуске
+# воркера или заранее (python partition_store.py, python risk_features.py): считает один воркер,
+# остальные ждут блокировки. Колбэки только читают готовые таблицы и до их появления показывают "не готово"
+def prepare_client_data():
+    try:
+        partition_store.manifest()
+        load_risk_features(snapshot, workers=int(os.getenv('RISK_WORKERS', 0)))
+    except Exception as e:
+        print(f"Ошибка подготовки данных клиентов: {e}", file=sys.stderr)
+
+
+threading.Thread(target=prepare_client_data, name='client-data', daemon=True).start()
+
+
+class ClientDataNotReady(Exception):
+    pass
+
+
+# Признаки считаются по снимку CLIENT_FILE_PATH, клиент выбирается из разделов PARTITION_SOURCE:
+# в рейтинге - только клиенты, раздел которых можно загрузить.
+# Пока данных нет - исключение, а не None: lru_cache не запоминает исключения
+@lru_cache(maxsize=1)
+def get_client_ranking():
+    features = read_risk_features(snapshot)
+    manifest = partition_store.prepared()
+    if features is None or manifest is None:
+        raise ClientDataNotReady()
+    return features[features.index.isin([entry['client_id'] for entry in manifest['clients']])]
+
+
+@lru_cache(maxsize=1)
+def ranked_clients():
+    # Порядок клиентов по убыванию риска для поиска в client-filter; клиенты без признаков - в конце
+    ranked = get_client_ranking().index.tolist()
+    ranks = dict(zip(ranked, range(len(ranked))))
+    return sorted(partition_store.clients(), key=lambda client_id: ranks.get(client_id, len(ranks)))
+
+
+def filter_conditions(filters):
+    conditions = []
+    if filters['year'] != 'all':
+        conditions.append(('year', filters['year']))
+    if filters['currency'] != 'all':
+        conditions.append(('account_amt_currency_code', filters['currency']))
+    if filters['client'] != 'all':  # Фильтр по клиенту
+        conditions.append(('client_id', filters['client']))
+    # Клик по столбцу графика: год + валюта
+    if filters['click']:
+        conditions.append(('year', filters['click']['year']))
+        conditions.append(('account_amt_currency_code', filters['click']['currency']))
+    return conditions
+
+
+def get_dataset(filters):
+    # Выбран клиент - работаем только с его разделом
+    if filters['client'] != 'all':
+        return partition_store.load(filters['client'])
+    return portfolio
+
+
+def data_sources(selection):
+    # Отпечаток файлов, из которых построены данные выборки (выгрузка, справочник, схема)
+    if selection['filters']['client'] != 'all':
+        return partition_store.manifest()['sources']
+    return snapshot.open().sources
+
+
+def select_positions(selection):
+    # Позиции строк выборки кэшируются по ключу выборки; None - все строки набора
+    dataset = get_dataset(selection['filters'])
+    conditions = filter_conditions(selection['filters'])
+    if not conditions:
+        return dataset, None
+    key = selection['key'] + ':positions'
+    positions = result_cache.get(key)
+    if positions is None:
+        positions = dataset.filter_index.select(conditions)
+        result_cache.put(key, positions)
+    return dataset, positions
+
+
+def make_selection(filters):
+    return {'key': selection_key(filters), 'filters': filters}
+
+
+def get_filtered_df(selection):
+    # Строки выборки берутся из рабочей таблицы по позициям: в кэше только позиции, без копии таблицы,
+    # вся выборка - сама таблица (страницы отображенного снимка остаются общими)
+    dataset, positions = select_positions(selection)
+    return dataset.df if positions is None else dataset.df.take(positions)
+
+
+# Колонки выборки для свободного вопроса: у раздела клиента в памяти все колонки,
+# для портфеля колонки вне рабочей таблицы читаются из снимка только для строк выборки
+def get_question_frame(selection, columns):
+    dataset, positions = select_positions(selection)
+    if dataset is portfolio:
+        return snapshot.load(columns, positions)
+    frame = dataset.df[columns]
+    return frame if positions is None else frame.take(positions)
+
+
+# Прогноз графика платежей для выборки; считается один раз на выборку и берется из кэша
+def get_cash_flows(selection):
+    key = selection['key'] + ':cash-flows'
+    cash_flows = result_cache.get(key)
+    if cash_flows is None:
+        dataset, positions = select_positions(selection)
+        cash_flows = dataset.amortization.cash_flows(positions)
+        result_cache.put(key, cash_flows)
+    return cash_flows
+
+
+# Ежемесячные платежи выборки и ПДН для всей сетки доходов; считаются один раз на выборку,
+# ползунок дохода дальше только выбирает строку сетки
+def get_income_scenarios(selection):
+    key = selection['key'] + ':income-scenarios'
+    scenarios = result_cache.get(key)
+    if scenarios is None:
+        dataset, positions = select_positions(selection)
+        scenarios = IncomeScenarios(dataset.debt_to_income.obligations(positions))
+        result_cache.put(key, scenarios)
+    return scenarios
+
+
+# Строки с задолженностью для таблицы, кэшируются по выборке; страница таблицы вырезается из них
+ARREAR_TABLE_COLUMNS = ['account_uid', 'arrear_amt_outstanding', 'arrear_calc_date', 'due_arrear_start_dt',
+                        'past_due_amt_past_due', 'overall_val_credit_total_amt']
+
+
+def get_arrears(selection):
+    key = selection['key'] + ':arrears'
+    arrears = result_cache.get(key)
+    if arrears is None:
+        filtered_df = get_filtered_df(selection)
+        arrears = filtered_df.loc[filtered_df['arrear_sign'] == 1, ARREAR_TABLE_COLUMNS].reset_index(drop=True)
+        result_cache.put(key, arrears)
+    return arrears
+
+
+# Ключ готовой фигуры: график, выборка и версия справочника (от нее зависят подписи кодов)
+def figure_key(chart_id, selection, *versions):
+    return (chart_id, selection['key'], mapping_registry.version) + versions
+
+
+# Диапазон оси x после увеличения графика: () - весь график (смена выборки, двойной клик),
+# None - событие relayout не меняет ось x (легенда, размеры), график не перестраиваем
+def zoom_range(graph_id, relayout_data):
+    if dash.callback_context.triggered_id != graph_id or not relayout_data:
+        return ()
+    if 'xaxis.range[0]' in relayout_data:
+        bounds = relayout_data['xaxis.range[0]'], relayout_data['xaxis.range[1]']
+    elif 'xaxis.range' in relayout_data:
+        bounds = relayout_data['xaxis.range']
+    elif relayout_data.get('xaxis.autorange'):
+        return ()
+    else:
+        return None
+    return tuple(np.datetime64(pd.Timestamp(bound), 'ns') for bound in bounds)
 
 
+# Маркеры по кредитам: при большом числе точек - прореживание min/max по датам и WebGL
+def marker_trace(x, y, x_range, **kwargs):
+    x = pd.to_datetime(x, errors='coerce').to_numpy(dtype='datetime64[ns]')
+    y = pd.to_numeric(y, errors='coerce').to_numpy(dtype=float)
+    if x_range:
+        visible = (x >= x_range[0]) & (x <= x_range[1])
+        x, y = x[visible], y[visible]
+    points = minmax_buckets(x, y)
+    trace = go.Scattergl if len(x) > THRESHOLD else go.Scatter
+    return trace(x=x[points], y=y[points], mode='markers', **kwargs)
 
+# Создание приложения Dash
+app = dash.Dash(__name__)
+server = app.server # Gunicorn запускает Flask-сервер
+metrics.instrument(server)  # /metrics и замеры запросов колбэков
 
 
-# Извлечение маппинга из строки 10 (ключи - числа, значения - текстовые описания)
-loan_kind_mapping_raw = mapping_df.iloc[10, 4]
-loan_kind_mapping = {}
+# Макет без данных: варианты фильтров приходят колбэком при загрузке страницы, выборку строит
+# unified_callback. Поэтому макет одинаков для всех запросов и сериализуется один раз (см. ниже)
+def serve_layout():
+    return html.Div(style={'backgroundColor': corporate_colors['background'],
+                           'fontFamily': 'Verdana, sans-serif'  # Шрифтовая схема
+                           }, children=[
+        # Загрузка страницы запускает колбэк с вариантами фильтров
+        dcc.Location(id='url'),
+        html.H1("Ваш помощник по кредитам", style={'textAlign': 'center', 'color': corporate_colors['text']}),
 
-# Разбиваем строку по строкам и заполняем словарь
-for line in str(loan_kind_mapping_raw).split("\n"):
-    parts = line.split("\t")
-    if len(parts) == 2:
-        key, value = parts
-        try:
-            loan_kind_mapping[int(key)] = value
-        except ValueError:
-            continue  # Пропустить строки, которые не соответствуют формату
+        # Фильтры
+        html.Div([
+            html.Div([
+                dcc.Dropdown(
+                    id='client-filter',
+                    # Клиентов может быть много: варианты подбираются на сервере по вводу (update_client_options)
+                    options=[{'label': 'Все клиенты', 'value': 'all'}],
+                    value='all',
+                    placeholder="Выберите клиента"
+                )
+            ], style={'width': '25%', 'padding': '10px','display':'none'}),
+
+            html.Div([
+                html.H3("Выберите год за который хотите узнать информацию", style={'textAlign': 'center', 'color': corporate_colors['text']}),
+                dcc.Dropdown(
+                    id='year-filter',
+                    options=[{'label': 'Все годы', 'value': 'all'}],
+                    value='all',
+                    placeholder="Выберите год"
+                )
+            ], style={'width': '35%', 'padding': '10px'}),
+
+            html.Div([
+                dcc.Dropdown(
+                    id='currency-filter',
+                    options=[{'label': 'Все валюты', 'value': 'all'}],
+                    value='all',
+                    placeholder="Выберите валюту"
+                )
+            ], style={'width': '25%', 'padding': '10px','display':'none'})
+
+        ], style={'display': 'flex'}),
+
+        # KPI метрики
+        # html.Div(id='kpi-cards', style={'display': 'grip', 'justifyContent': 'space-around', 'padding': '20px'}),
+        html.Div(id='kpi-cards', style={
+            'display': 'grid',
+            'grid-template-columns': 'repeat(auto-fit, minmax(45%, 1fr))',
+            'gap': '30px',
+            'padding': '10px'
+        }),
+        # Рейтинг клиентов по риску: выбор строки выбирает клиента (скрытый client-filter)
+        html.Div([
+            html.H3("Клиенты с наибольшим риском", style={'margin': '20px 0', 'color': corporate_colors['text']}),
+            html.Div(id='client-ranking-status', style={'color': corporate_colors['text']}),
+            # Сброс выбранного клиента: client-filter скрыт, вернуться к портфелю можно только здесь
+            html.Button('ВЕСЬ ПОРТФЕЛЬ',
+                        id='client-reset',
+                        n_clicks=0,
+                        style={
+                        'padding': '6px 12px',
+                        'marginBottom': '10px',
+                        'borderRadius': '5px',
+                        'backgroundColor': '#4B0082',
+                        'color': 'white',
+                        'fontFamily': 'Verdana',
+                        'cursor': 'pointer'
+                    }),
+            dash_table.DataTable(
+                id='client-ranking',
+                style_data={
+                        'backgroundColor': corporate_colors['card'],
+                        'color': corporate_colors['text']
+                    },
+                style_header={
+                        'backgroundColor': '#4B0082',
+                        'color': 'white',
+                        'fontWeight': 'bold'
+                    },
+                columns=[
+                    {'name': 'Клиент', 'id': 'client_id'},
+                    {'name': 'Оценка риска', 'id': 'risk_score'},
+                    {'name': 'Кредитов', 'id': 'loans'},
+                    {'name': 'Открытых', 'id': 'open_loans'},
+                    {'name': 'Закрытых', 'id': 'closed_loans'},
+                    {'name': 'Просрочек 30+', 'id': 'delay30'},
+                    {'name': 'Просрочек 90+', 'id': 'delay90'},
+                    {'name': 'Макс. просрочка', 'id': 'cred_max_overdue'},
+                    {'name': 'Сумма просрочки', 'id': 'past_due_amt_past_due'},
+                    {'name': 'Сумма задолженности', 'id': 'arrear_amt_outstanding'}
+                ],
+                style_table={'overflowX': 'auto'},
+                style_cell={'textAlign': 'left', 'minWidth': '100px'},
+                page_size=10
+            )
+        ], style={'padding': '20px'}),
+        # Новые круговые диаграммы
+        html.Div([
+            html.Div([
+                dcc.Graph(id='loan-kind-pie'),
+            ], style={'width': '100%', 'padding': '10px'}),
+
+            html.Div([
+                dcc.Graph(id='loan-purpose-pie'),
+            ], style={'width': '100%', 'padding': '10px'})
+        ]),
+        # Основные Графики
+        html.Div([
+            dcc.Graph(id='amount-by-year', style={'width': '100%', 'padding': '10px','display':'none'}),
+            dcc.Graph(id='count-by-year', style={'width': '100%', 'padding': '10px','display':'none'}),
+            dcc.Graph(id='cumulative-debt', style={'width': '100%', 'padding': '10px'}),
+            dcc.Graph(id='delinquency-heatmap', style={'width': '100%', 'padding': '10px'}),
+            dcc.Graph(id='key-rate-overlay', style={'width': '100%', 'padding': '10px'}),
+            dcc.Graph(id='cost-scatter', style={'width': '100%', 'padding': '10px','display':'none'}),
+            dcc.Graph(id='dynamic-line', style={'width': '100%', 'padding': '10px','display':'none'}),
 
-# Преобразование колонки 'trade_loan_kind_code' в числовой формат
-df['trade_loan_kind_code'] = pd.to_numeric(df['trade_loan_kind_code'], errors='coerce')
 
-# Замена кодов на текстовые значения
-df['trade_loan_kind_code'] = df['trade_loan_kind_code'].map(loan_kind_mapping)
+        ]),
+        # Скрытый элемент для хранения данных о выборе
+        dcc.Store(id='crossfilter-selection'),
 
-# === Обработка trade_acct_type1 ===
+        # В макет добавьте:
+        html.Div([
+            dcc.Graph(id='payment-schedule', style={'width': '100%', 'padding': '10px'})
+        ], style={'padding': '20px'}),
 
-acct_type_mapping_raw = mapping_df.iloc[11, 4]  # Маппинг из строки 11
-acct_type_mapping = {}
 
-# Разбираем строки (код + описание), где код может содержать точки
-for line in str(acct_type_mapping_raw).split("\n"):
-    parts = line.split(" ", 1)  # Разделяем по первому пробелу (код - описание)
-    if len(parts) == 2:
-        key, value = parts
-        try:
-            acct_type_mapping[float(key)] = value  # Храним как float для кодов типа 2.1, 4.5
-        except ValueError:
-            continue
+        # Таблица с задолженностью
+        html.Div([
+            html.H3("Список непогашенных кредитов", style={'margin': '20px 0'}),
+            html.Div(id='arrear-table-info', style={'color': corporate_colors['text'], 'marginBottom': '10px'}),
+            dash_table.DataTable(
+                style_data={
+                        'backgroundColor': corporate_colors['card'],
+                        'color': corporate_colors['text']
+                    },
+                style_header={
+                        'backgroundColor': '#4B0082',
+                        'color': 'white',
+                        'fontWeight': 'bold'
+                    },
+                id='arrear-table',
+                columns=[
+                    {'name': 'ID кредита', 'id': 'account_uid'},
+                    {'name': 'Сумма задолженности', 'id': 'arrear_amt_outstanding'},
+                    {'name': 'Дата расчета', 'id': 'arrear_calc_date'},
+                    {'name': 'Дата срочной задолженности', 'id': 'due_arrear_start_dt'},
+                    {'name': 'Сумма просрочки', 'id': 'past_due_amt_past_due'},
+                    {'name': 'Процентная ставка', 'id': 'overall_val_credit_total_amt'}
+                ],
+                style_table={'overflowX': 'auto'},
+                style_cell={'textAlign': 'left', 'minWidth': '100px'},
+                # Страницы, сортировка и фильтр считаются на сервере, в браузер уходит одна страница
+                page_action='custom',
+                page_current=0,
+                page_size=10,
+                sort_action='custom',
+                sort_mode='multi',
+                sort_by=[],
+                filter_action='custom',
+                filter_query=''
 
-# Преобразование trade_acct_type1 в числовой формат
-# client_df['trade_acct_type1'] = client_df['trade_acct_type1'].astype(str).str.strip()
-df['trade_acct_type1'] = pd.to_numeric(df['trade_acct_type1'], errors='coerce')
+            )
+        ], style={'padding': '20px'}),
+        # Блок с доходом: границы и шаг ползунка задаются по платежам выборки (update_income_plot)
+        html.Div([
+            html.H3("Среднемесячный доход", style={'margin': '20px 0', 'color': corporate_colors['text']}),
+            dcc.Slider(
+                id='income-slider',
+                min=0,
+                max=100000,
+                step=1000,
+                value=None,
+                updatemode='drag',
+                tooltip={'placement': 'bottom', 'always_visible': True}
+            )
+        ], style={'padding': '20px'}),
 
-# Маппинг (сопоставляем float)
-df['trade_acct_type1'] = df['trade_acct_type1'].map(acct_type_mapping)
+        # График с доходом
+        dcc.Graph(id='income-plot'),
 
+        # Блок с рекомендациями от GigaChat
+        html.Div([
+            html.H3("Рекомендации по кредитному портфелю", style={'margin': '20px 0'}),
+            dcc.Input(
+                    id='user-question',
+                    type='text',
+                    placeholder='Введите ваш вопрос...',
+                    style={
+                        'width': '100%',
+                        'height': '50px',
+                        'fontSize': '18px',
+                        'fontFamily': 'Verdana',
+                        'marginBottom': '10px'
+                        }
+                ),
+            html.Button('ОТПРАВИТЬ',
+                        id='submit-question',
+                        n_clicks=0,
+                        style={
+                        'fontSize': '18px',  # Уеличен шрифт кнопки
+                        'padding': '6px 12px',  # Увеличен размер кнопки
+                        'borderRadius': '5px',
+                        'backgroundColor': '#4B0082',
+                        'color': 'white',
+                        'fontFamily': 'Verdana',
+                        'cursor': 'pointer'
+                    }
+            ),
+            dcc.Markdown(id='llm-output', style={
+                'background': corporate_colors['card'],
+                'padding': '15px',
+                'borderRadius': '5px',
+                'marginTop': '10px',
+                # 'whiteSpace': 'pre-wrap'  # Для форматирования текста
+                'border': '1px solid #EEE'
+            }),
+            # Фоновое задание LLM и таймер опроса его результата
+            dcc.Store(id='llm-job'),
+            dcc.Interval(id='llm-poll', interval=1000, disabled=True)
+        ], style={'padding': '20px'}),
+    ])
 
-# Предобработка данных
-df["year"] = df["fund_date"].dt.year
-closed_loans = df[df["loan_indicator"] == 1]
 
-# Корпоративная цветовая схема
-corporate_colors = {
-    'background': '#F5F3FF',
-    'text': '#4B0082',
-    'colorscale': ['#7E5BEF', '#A389F4', '#C9B9FC', '#E5DEFF'],
-    'card': '#FFFFFF'
-}
+app.layout = serve_layout
 
-# Создание приложения Dash
-app = dash.Dash(__name__)
-server = app.server # Gunicorn запускает Flask-сервер
-app.layout = html.Div(style={'backgroundColor': corporate_colors['background'],
-                             'fontFamily': 'Verdana, sans-serif'  # Шрифтовая схема
-                             }, children=[
-    html.H1("Ваш помощник по кредитам", style={'textAlign': 'center', 'color': corporate_colors['text']}),
 
-    # Фильтры
-    html.Div([
-        html.Div([
-            dcc.Dropdown(
-                id='client-filter',
-                options=[{'label': 'Все клиенты', 'value': 'all'}] +
-                        [{'label': str(cid), 'value': cid} for cid in df['client_id'].unique()],
-                value='all',
-                placeholder="Выберите клиента"
-            )
-        ], style={'width': '25%', 'padding': '10px','display':'none'}),
+# Готовый JSON макета: /_dash-layout отдается без сборки дерева компонентов и сериализации на каждый заход
+@lru_cache(maxsize=1)
+def layout_json():
+    return to_json_plotly(app.get_layout())
 
-        html.Div([
-            html.H3("Выберите год за который хотите узнать информацию", style={'textAlign': 'center', 'color': corporate_colors['text']}),
-            dcc.Dropdown(
-                id='year-filter',
-                options=[{'label': 'Все годы', 'value': 'all'}] +
-                        [{'label': str(year), 'value': year} for year in sorted(df['year'].unique())],
-                value='all',
-                placeholder="Выберите год"
-            )
-        ], style={'width': '35%', 'padding': '10px'}),
 
-        html.Div([
-            dcc.Dropdown(
-                id='currency-filter',
-                options=[{'label': 'Все валюты', 'value': 'all'}] +
-                        [{'label': curr, 'value': curr} for curr in df['account_amt_currency_code'].unique()],
-                value='all',
-                placeholder="Выберите валюту"
-            )
-        ], style={'width': '25%', 'padding': '10px','display':'none'})
-
-    ], style={'display': 'flex'}),
-
-    # KPI метрики
-    # html.Div(id='kpi-cards', style={'display': 'grip', 'justifyContent': 'space-around', 'padding': '20px'}),
-    html.Div(id='kpi-cards', style={
-        'display': 'grid',
-        'grid-template-columns': 'repeat(auto-fit, minmax(45%, 1fr))',
-        'gap': '30px',
-        'padding': '10px'
-    }),
-    # Новые круговые диаграммы
-    html.Div([
-        html.Div([
-            dcc.Graph(id='loan-kind-pie'),
-        ], style={'width': '100%', 'padding': '10px'}),
+@server.before_request
+def serve_cached_layout():
+    if request.path == app.config.routes_pathname_prefix + '_dash-layout':
+        response = Response(layout_json(), mimetype='application/json')
+        response.add_etag()
+        return response.make_conditional(request)
 
-        html.Div([
-            dcc.Graph(id='loan-purpose-pie'),
-        ], style={'width': '100%', 'padding': '10px'})
-    ]),
-    # Основные Графики
-    html.Div([
-        dcc.Graph(id='amount-by-year', style={'width': '100%', 'padding': '10px','display':'none'}),
-        dcc.Graph(id='count-by-year', style={'width': '100%', 'padding': '10px','display':'none'}),
-        dcc.Graph(id='cumulative-debt', style={'width': '100%', 'padding': '10px'}),
-        dcc.Graph(id='cost-scatter', style={'width': '100%', 'padding': '10px','display':'none'}),
-        dcc.Graph(id='dynamic-line', style={'width': '100%', 'padding': '10px','display':'none'}),
-
-
-    ]),
-    # Скрытый элемент для хранения данных о выборе
-    dcc.Store(id='crossfilter-selection', data=df.to_json(date_format='iso', orient='split')),
-
-    # В макет добавьте:
-    html.Div([
-        dcc.Graph(id='payment-schedule', style={'width': '100%', 'padding': '10px'})
-    ], style={'padding': '20px'}),
-
-
-    # Таблица с задолженностью
-    html.Div([
-        html.H3("Список непогашенных кредитов", style={'margin': '20px 0'}),
-        dash_table.DataTable(
-            style_data={
-                    'backgroundColor': corporate_colors['card'],
-                    'color': corporate_colors['text']
-                },
-            style_header={
-                    'backgroundColor': '#4B0082',
-                    'color': 'white',
-                    'fontWeight': 'bold'
-                },
-            id='arrear-table',
-            columns=[
-                {'name': 'ID кредита', 'id': 'account_uid'},
-                {'name': 'Сумма задолженности', 'id': 'arrear_amt_outstanding'},
-                {'name': 'Дата расчета', 'id': 'arrear_calc_date'},
-                {'name': 'Дата срочной задолженности', 'id': 'due_arrear_start_dt'},
-                {'name': 'Сумма просрочки', 'id': 'past_due_amt_past_due'},
-                {'name': 'Процентная ставка', 'id': 'overall_val_credit_total_amt'}
-            ],
-            style_table={'overflowX': 'auto'},
-            style_cell={'textAlign': 'left', 'minWidth': '100px'},
-            page_size=10
-
-        )
-    ], style={'padding': '20px'}),
-    # Блок с доходом
-    html.Div([
-        dcc.Input(
-            id='income-input',
-            type='number',
-            placeholder='Введите среднем.есячный доход',
-            style={'marginRight': '10px',
-                    'marginLeft': '10px',
-                    'width': '15%',
-                    'height': '30px',
-                    'fontSize': '18px',
-                    'fontFamily': 'Verdana',
-                    'marginBottom': '10px'
-                   }
-        ),
-        html.Button('ДОБАВИТЬ',
-                    id='upgrade-button',
-                    n_clicks=0,
-                    style={
-                    'fontSize': '18px',  # Уеличен шрифт кнопки
-                    'padding': '6px 12px',  # Увеличен размер кнопки
-                    'borderRadius': '5px',
-                    'backgroundColor': '#4B0082',
-                    'color': 'white',
-                    'fontFamily': 'Verdana',
-                    'cursor': 'pointer'
-                }
-                    )
-    ], style={'padding': '20px',
 
-              }),
+# Варианты года и валюты приходят при загрузке страницы, а не встраиваются в макет
+@callback(
+    [Output('year-filter', 'options'),
+     Output('currency-filter', 'options')],
+    [Input('url', 'pathname')]
+)
+@metrics.track_callback
+def load_filter_options(pathname):
+    years = [{'label': str(year), 'value': year} for year in sorted(df['year'].unique())]
+    currencies = [{'label': curr, 'value': curr} for curr in df['account_amt_currency_code'].unique()]
+    return ([{'label': 'Все годы', 'value': 'all'}] + years,
+            [{'label': 'Все валюты', 'value': 'all'}] + currencies)
 
-    # График с доходом
-    dcc.Graph(id='income-plot'),
 
-    # Блок с рекомендациями от GigaChat
-    html.Div([
-        html.H3("Рекомендации по кредитному портфелю", style={'margin': '20px 0'}),
-        dcc.Input(
-                id='user-question',
-                type='text',
-                placeholder='Введите ваш вопрос...',
-                style={
-                    'width': '100%',
-                    'height': '50px',
-                    'fontSize': '18px',
-                    'fontFamily': 'Verdana',
-                    'marginBottom': '10px'
-                    }
-            ),
-        html.Button('ОТПРАВИТЬ',
-                    id='submit-question',
-                    n_clicks=0,
-                    style={
-                    'fontSize': '18px',  # Уеличен шрифт кнопки
-                    'padding': '6px 12px',  # Увеличен размер кнопки
-                    'borderRadius': '5px',
-                    'backgroundColor': '#4B0082',
-                    'color': 'white',
-                    'fontFamily': 'Verdana',
-                    'cursor': 'pointer'
-                }
-        ),
-        dcc.Markdown(id='llm-output', style={
-            'background': corporate_colors['card'],
-            'padding': '15px',
-            'borderRadius': '5px',
-            'marginTop': '10px',
-            # 'whiteSpace': 'pre-wrap'  # Для форматирования текста
-            'border': '1px solid #EEE'
-        })
-    ], style={'padding': '20px'}),
-])
+# Клиенты подбираются на сервере по введенному началу номера; выбранный клиент всегда остается в списке
+CLIENT_OPTIONS_LIMIT = 50
+
+
+@callback(
+    Output('client-filter', 'options'),
+    [Input('client-filter', 'search_value'),
+     Input('client-filter', 'value')]
+)
+@metrics.track_callback
+def update_client_options(search_value, value):
+    options = [{'label': 'Все клиенты', 'value': 'all'}]
+    if value not in (None, 'all'):
+        options.append({'label': client_label(value), 'value': value})
+    if search_value:
+        try:
+            clients = ranked_clients()
+        except ClientDataNotReady:
+            return options
+        # Найденные клиенты - по убыванию риска
+        matches = (client_id for client_id in clients
+                   if str(client_id).startswith(search_value.strip()) and client_id != value)
+        options += [{'label': client_label(client_id), 'value': client_id}
+                    for _, client_id in zip(range(CLIENT_OPTIONS_LIMIT), matches)]
+    return options
+
+
+def client_label(client_id):
+    try:
+        features = get_client_ranking()
+    except ClientDataNotReady:
+        features = None
+    if features is None or client_id not in features.index:
+        return f"{client_id} · риск н/д"
+    return f"{client_id} · риск {features.at[client_id, 'risk_score']:.2f}"
+
+
+# Рейтинг клиентов строится из таблицы признаков при загрузке страницы
+CLIENT_RANKING_SIZE = 100
+
+
+@callback(
+    [Output('client-ranking', 'data'),
+     Output('client-ranking-status', 'children')],
+    [Input('url', 'pathname')]
+)
+@metrics.track_callback
+def load_client_ranking(pathname):
+    try:
+        ranking = get_client_ranking()
+    except ClientDataNotReady:
+        return [], "Рейтинг еще не готов: признаки клиентов рассчитываются, обновите страницу позже"
+    ranking = ranking.head(CLIENT_RANKING_SIZE).astype({'risk_score': float}).round(2).reset_index()
+    # id строки - клиент: по нему выбор строки передается в client-filter
+    return ranking.assign(id=ranking['client_id']).to_dict('records'), None
+
+
+@callback(
+    [Output('client-filter', 'value'),
+     Output('client-ranking', 'active_cell'),
+     Output('client-ranking', 'selected_cells')],
+    [Input('client-ranking', 'active_cell'),
+     Input('client-reset', 'n_clicks')],
+    prevent_initial_call=True
+)
+@metrics.track_callback
+def select_ranked_client(active_cell, reset_clicks):
+    # Кнопка сброса или снятое выделение в рейтинге - снова весь портфель;
+    # выделение снимается, чтобы повторный клик по той же строке снова выбрал клиента
+    if dash.callback_context.triggered_id == 'client-reset' or active_cell is None:
+        return 'all', None, []
+    try:
+        ranking = get_client_ranking()
+    except ClientDataNotReady:
+        return dash.no_update, dash.no_update, dash.no_update
+    if active_cell.get('row_id') not in ranking.index:
+        return dash.no_update, dash.no_update, dash.no_update
+    return active_cell['row_id'], dash.no_update, dash.no_update
 
 
 # Объединенный колбэк для всех выходов
 @callback(
     [Output('crossfilter-selection', 'data'),
      Output('kpi-cards', 'children'),
-     Output('llm-output', 'children')],
+     Output('llm-job', 'data')],
     [Input('year-filter', 'value'),
      Input('currency-filter', 'value'),
      Input('client-filter', 'value'),
@@ -274,51 +630,45 @@ app.layout = html.Div(style={'backgroundColor': corporate_colors['background'],
      Input('count-by-year', 'clickData'),
      Input('submit-question', 'n_clicks')],
     [State('user-question', 'value'),
-     State('crossfilter-selection', 'data')]
+     State('crossfilter-selection', 'data'),
+     State('llm-job', 'data')]
 )
 # def update_data(selected_year, selected_currency, selected_client, click_amount, click_count):
 #     ctx = dash.callback_context
 #     filtered_df = df.copy()
+@metrics.track_callback
 def unified_callback(selected_year, selected_currency, selected_client,
                     click_amount, click_count, n_clicks,
-                    question, filtered_data):
+                    question, filtered_data, llm_job):
     ctx = dash.callback_context
     triggered_id = ctx.triggered[0]['prop_id'].split('.')[0] if ctx.triggered else None
 
     # Обработка фильтров и KPI
     if triggered_id in ['year-filter', 'currency-filter', 'client-filter',
                        'amount-by-year', 'count-by-year', None]:
-        filtered_df = df.copy()
-    # Фильтрация данных
-        if selected_year != 'all':
-            filtered_df = filtered_df[filtered_df['year'] == selected_year]
-        if selected_currency != 'all':
-            filtered_df = filtered_df[filtered_df['account_amt_currency_code'] == selected_currency]
-        if selected_client != 'all':  # Фильтр по клиенту
-            filtered_df = filtered_df[filtered_df['client_id'] == selected_client]
+        filters = {'year': selected_year, 'currency': selected_currency,
+                   'client': selected_client, 'click': None}
         # Обработка кликов на графиках
-        if ctx.triggered:
-            trigger_id = ctx.triggered[0]['prop_id'].split('.')[0]
-            if trigger_id in ['amount-by-year', 'count-by-year']:
-                click_data = click_amount if trigger_id == 'amount-by-year' else click_count
-                if click_data:
-                    point = click_data['points'][0]
-                    filtered_df = filtered_df[
-                        (filtered_df['year'] == point['x']) &
-                        (filtered_df['account_amt_currency_code'] == point['customdata'][0]) &
-                        ((filtered_df['client_id'] == selected_client) if selected_client != 'all' else True)
-                        ]
-
-        # Расчет KPI
+        if triggered_id in ['amount-by-year', 'count-by-year']:
+            click_data = click_amount if triggered_id == 'amount-by-year' else click_count
+            if click_data:
+                point = click_data['points'][0]
+                filters['click'] = {'year': point['x'], 'currency': point['customdata'][0]}
+        # Сама выборка строится колбэками-потребителями через кэш
+        selection = make_selection(filters)
+
+        # Расчет KPI по срезу куба
         # Расчет KPI с проверкой на пустые данные
-        if filtered_df.empty:
+        agg_cube = get_dataset(filters).agg_cube
+        cells = agg_cube.slice(filter_conditions(filters))
+        if cells.empty:
             total_loans = total_closed = total_amount = total_closed_amount = 0
         else:
-            total_loans = filtered_df.shape[0]
-            total_closed = filtered_df['loan_indicator'].sum()
-            total_amount = filtered_df['account_amt_credit_limit'].sum(skipna=True)
-            total_closed_amount = filtered_df.loc[filtered_df['loan_indicator'] == 1, 'account_amt_credit_limit'].sum(
-                skipna=True)
+            totals = agg_cube.totals(cells)
+            total_loans = totals['total_loans']
+            total_closed = totals['total_closed']
+            total_amount = totals['total_amount']
+            total_closed_amount = totals['total_closed_amount']
 
         kpi_cards = [
             create_kpi_card("Всего кредитов", total_loans, "#1f77b4"),
@@ -326,142 +676,263 @@ def unified_callback(selected_year, selected_currency, selected_client,
             create_kpi_card("Общая сумма", f"{total_amount:,.0f}", "#d62728"),
             create_kpi_card("Погашенная сумма", f"{total_closed_amount:,.0f}", "#9467bd")
         ]
-        # Рекомендации по
-        try:
-            kpi_data = {
-                "total_loans": total_loans,
-                "total_closed": total_closed,
-                "total_amount": total_amount,
-                "total_closed_amount": total_closed_amount
-            }
-        # # Получаем рекомендации
-        # try:
-            response = send_prompt_to_llm(kpi_data, giga_token)
-            recommendation = response.choices[0].message.content
-        except Exception as e:
-            recommendation = f"Ошибка получения рекомендаций: {str(e)}"
-
-        return filtered_df.to_json(date_format='iso', orient='split'), kpi_cards, recommendation
+        # Рекомендации по KPI готовятся в фоне, фильтры и KPI не ждут ответа LLM
+        kpi_data = {
+            "total_loans": total_loans,
+            "total_closed": total_closed,
+            "total_amount": total_amount,
+            "total_closed_amount": total_closed_amount
+        }
+        job_id = llm_jobs.submit(get_recommendation, kpi_data, replaces=job_id_of(llm_job))
+
+        return selection, kpi_cards, {'job_id': job_id}
     # Обработка пользовательского вопроса
     elif triggered_id == 'submit-question' and question:
-        try:
-            # mapping_df = pd.read_csv(mapping_file_path, delimiter=';')
-            # Загрузка данных с правильными параметрами
-            mapping_df = pd.read_csv(
-                "maping_csv.csv",
-                delimiter=";",
-                skiprows=2,  # Пропускаем первые две строки (заголовок и разделитель)
-                names=["Поле", "Описание"],  # Только две колонки
-                usecols=[2, 3],  # Берем данные из 2-й и 3-й колонок файла
-                encoding='utf-8-sig'  # Для корректной работы с BOM
-            )
-            client_df = pd.read_json(filtered_data, orient='split')
+        job_id = llm_jobs.submit(answer_question, question, filtered_data, replaces=job_id_of(llm_job))
+        return dash.no_update, dash.no_update, {'job_id': job_id}
 
-            # Удаляем лишние символы в названиях колонок
-            mapping_df["Поле"] = (
-                mapping_df["Поле"]
-                .str.strip()  # Удаляем пробелы
-                .str.replace("['\",]", "", regex=True)  # Удаляем кавычки и запятые
-            )
-            # Создание словаря для переименования
-            rename_dict = dict(zip(mapping_df["Поле"], mapping_df["Описание"]))
-
-            # Переименование колонок
-            client_df_rus = client_df.rename(columns=rename_dict)
-            # print(list(client_df_rus.columns))
-
-            # Формирование контекста маппинга
-            mapping_context = "\n".join([f"{row['Поле']}: {row['Описание']}" for _, row in mapping_df.iterrows()])
-            # print(mapping_context)
-
-            # Статистика с русскими названиями колонок
-            data_stats = client_df_rus.describe().to_string()
-            # print(data_stats)
-
-
-
-            # # Применяем переименование
-            # df_rus = client_df.rename(columns=rename_dict)
-
-            # # Анализ маппинга
-            # mapping_context = ""
-            # for idx, row in mapping_giga.iterrows():
-            #     mapping_context += f"Строка {idx}: {row[4]}\n"
-
-            # Формирование промпта
-            prompt = f"""
-            Вопрос пользователя: {question}
-
-            Справочник параметров:
-            {mapping_context}
-
-            Задача:
-            1. Определить соответствующий параметр из колонок: 
-            {list(client_df_rus.columns)}
-            2. Ответить на вопрос используя данные из {client_df_rus}
-            3. Дать ответ используя терминологию из справочника.
-            
-            Пример правильного ответа:
-            "Сумма платежа в августе 2023 составляет X рублей, 
-            рассчитанная на основе [русское название колонки]"
-            
-            Статистика данных (русские названия):
-            {data_stats}  
+    return dash.no_update, dash.no_update, {'message': "Ожидаю ваш вопрос..."}
+
+
+# Ответ на вопрос пользователя по текущей выборке (выполняется в фоновом задании)
+def answer_question(question, filtered_data):
+    # Тот же вопрос по той же выборке тех же данных отвечается из кэша: SQLite переживает перезапуск,
+    # после новой выгрузки ключ меняется вместе с отпечатком источника
+    cache_key = prompt_key('question', question.lower(), filtered_data['key'], data_sources(filtered_data))
+    cached = llm_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    try:
+        # Вопрос может касаться любой колонки выгрузки, а не только рабочих колонок дашборда
+        columns = context_builder.relevant_columns(question, snapshot.columns)
+        client_df = get_question_frame(filtered_data, columns)
+
+        # Сводка только по релевантным вопросу параметрам, в пределах бюджета токенов
+        data_context = context_builder.build(question, client_df, filtered_data['key'])
+
+        # Формирование промпта
+        prompt = f"""
+        Вопрос пользователя: {question}
+
+        Сводка по выборке кредитов (русское название параметра, колонка и агрегаты):
+        {data_context}
+
+        Задача:
+        1. Определить соответствующий параметр из сводки.
+        2. Ответить на вопрос используя агрегаты из сводки.
+        3. Дать ответ используя терминологию из справочника.
+        
+        Пример правильного ответа:
+        "Сумма платежа в августе 2023 составляет X рублей, 
+        рассчитанная на основе [русское название колонки]"
  
-            """
+        """
+
+        # Отправка запроса
+        answer = llm_chat('question', prompt)
+        llm_cache.put(cache_key, answer)
+        return answer
+
+    except Exception as e:
+        return f"Ошибка: {str(e)}"
+
+
+# Рекомендации по KPI (выполняется в фоновом задании)
+def get_recommendation(kpi_data):
+    try:
+        return send_prompt_to_llm(kpi_data, giga_token)
+    except Exception as e:
+        return f"Ошибка получения рекомендаций: {str(e)}"
 
-            # Отправка запроса
-            with GigaChat(credentials=giga_token, verify_ssl_certs=False) as giga:
-                response = giga.chat(prompt)
-                answer = response.choices[0].message.content
-            return dash.no_update, dash.no_update, answer
 
-        except Exception as e:
-            return dash.no_update, dash.no_update, f"Ошибка: {str(e)}"
+def job_id_of(llm_job):
+    return llm_job.get('job_id') if llm_job else None
+
+
+# Опрос фонового задания LLM: рекомендации появляются, когда придет ответ
+@callback(
+    [Output('llm-output', 'children'),
+     Output('llm-poll', 'disabled')],
+    [Input('llm-job', 'data'),
+     Input('llm-poll', 'n_intervals')]
+)
+@metrics.track_callback
+def poll_llm_job(llm_job, n_intervals):
+    if not llm_job:
+        return dash.no_update, True
+    if 'message' in llm_job:
+        return llm_job['message'], True
+    status, result = llm_jobs.poll(llm_job['job_id'])
+    if status == 'pending':
+        triggered_id = dash.callback_context.triggered_id
+        return ("Готовим рекомендации..." if triggered_id == 'llm-job' else dash.no_update), False
+    if status == 'unknown':
+        return "Ответ недоступен, повторите запрос", True
+    return result, True
+
 
-    return dash.no_update, dash.no_update, "Ожидаю ваш вопрос..."
 @callback(
     [Output('loan-kind-pie', 'figure'),
-     Output('loan-purpose-pie', 'figure'),
-     Output('arrear-table', 'data'),
-     Output('income-plot', 'figure')],
-    [Input('crossfilter-selection', 'data'),
-     Input('upgrade-button', 'n_clicks')],
-    [State('income-input', 'value')]
+     Output('loan-purpose-pie', 'figure')],
+    [Input('crossfilter-selection', 'data')]
 )
 
-def update_additional_elements(filtered_data, n_clicks, income):
+@metrics.track_callback
+def update_additional_elements(filtered_data):
+    if not filtered_data:
+        return no_data_figure(), no_data_figure()
+    # Круговые диаграммы: выборка строится только при промахе кэша фигур
     try:
-        filtered_df = pd.read_json(filtered_data, orient='split') if filtered_data else pd.DataFrame()
-        # Добавляем преобразование типа для 'fund_date'
-        if not filtered_df.empty and 'fund_date' in filtered_df.columns:
-            filtered_df['fund_date'] = pd.to_datetime(filtered_df['fund_date'])
-    except:
-        filtered_df = pd.DataFrame()
+        loan_kind_fig, loan_purpose_fig = figure_cache.get_or_build(figure_key('loan-pies', filtered_data),
+                                                                    lambda: build_loan_pies(filtered_data))
+    except Exception:
+        # Ошибка выборки - заглушки, в кэш они не попадают
+        return no_data_figure(), no_data_figure()
 
-    # Заглушки для пустых данных
-    empty_fig = px.scatter(title="Нет данных").update_layout(
-        plot_bgcolor=corporate_colors['card'],
-        paper_bgcolor=corporate_colors['background'],
-        font_color=corporate_colors['text']
+    return loan_kind_fig, loan_purpose_fig
+
+
+# Таблица с задолженностью: фильтр, сортировка и страница применяются к кэшированным строкам выборки
+@callback(
+    [Output('arrear-table', 'data'),
+     Output('arrear-table', 'page_count'),
+     Output('arrear-table-info', 'children')],
+    [Input('crossfilter-selection', 'data'),
+     Input('arrear-table', 'page_current'),
+     Input('arrear-table', 'page_size'),
+     Input('arrear-table', 'sort_by'),
+     Input('arrear-table', 'filter_query')]
+)
+@metrics.track_callback
+def update_arrear_table(filtered_data, page_current, page_size, sort_by, filter_query):
+    started = time.perf_counter()
+    page, total, page_count = query_table(get_arrears(filtered_data), filter_query, sort_by, page_current, page_size)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    info = f"Найдено строк: {total:,}".replace(',', ' ') + f" · запрос {elapsed_ms:.0f} мс"
+    # Даты в таблице - без времени, как в выгрузке
+    for column in page.select_dtypes('datetime').columns:
+        page = page.assign(**{column: page[column].dt.strftime('%Y-%m-%d')})
+    return page.to_dict('records'), page_count, info
+
+
+# График с доходом: платежи и сетка сценариев дохода считаются только при смене выборки
+@callback(
+    [Output('income-plot', 'figure'),
+     Output('income-slider', 'max'),
+     Output('income-slider', 'step'),
+     Output('income-slider', 'marks')],
+    [Input('crossfilter-selection', 'data')],
+    [State('income-slider', 'value')]
+)
+@metrics.track_callback
+def update_income_plot(filtered_data, income):
+    scenarios = get_income_scenarios(filtered_data)
+    if scenarios.empty:
+        return no_data_figure("Платежи vs Доход"), dash.no_update, dash.no_update, dash.no_update
+    fig = figure_cache.get_or_build(figure_key('income-plot', filtered_data),
+                                    lambda: build_income_plot(scenarios))
+    # Уже выбранный доход сохраняется при смене фильтров
+    apply_income(fig, scenarios, income)
+    return fig, float(scenarios.incomes[-1]), scenarios.step, income_marks(scenarios)
+
+
+# Движение ползунка меняет только кривую ПДН и месяцы превышения: частичное обновление фигуры
+@callback(
+    Output('income-plot', 'figure', allow_duplicate=True),
+    [Input('income-slider', 'value')],
+    [State('crossfilter-selection', 'data')],
+    prevent_initial_call=True
+)
+@metrics.track_callback
+def update_income_scenario(income, filtered_data):
+    if not filtered_data:
+        return dash.no_update
+    scenarios = get_income_scenarios(filtered_data)
+    if scenarios.empty:
+        return dash.no_update
+    return apply_income(Patch(), scenarios, income)
+
+
+def apply_income(fig, scenarios, income):
+    # Строка сетки для выбранного дохода: кривая ПДН (trace 1), месяцы выше порога (trace 2) и заголовок.
+    # fig - словарь фигуры или Patch, присваивания одинаковы
+    if not income:
+        fig['data'][1]['y'] = []
+        fig['data'][2]['x'] = []
+        fig['data'][2]['y'] = []
+        fig['layout']['title']['text'] = "Платежи vs Доход: выберите доход"
+        return fig
+    row = scenarios.index(income)
+    dti = scenarios.dti[row]
+    breach = dti > scenarios.threshold
+    safe = scenarios.safe_income()
+    fig['data'][1]['y'] = np.round(dti, 4).tolist()
+    fig['data'][2]['x'] = scenarios.months[breach].strftime('%Y-%m-%d').tolist()
+    fig['data'][2]['y'] = np.round(dti[breach], 4).tolist()
+    fig['layout']['title']['text'] = (
+        f"Платежи vs Доход {format_amount(scenarios.incomes[row])}: максимальный ПДН {dti.max():.0%}, "
+        f"месяцев выше {scenarios.threshold:.0%}: {int(scenarios.breaches[row])}"
+        + (f", порог не превышается при доходе от {format_amount(safe)}" if safe is not None else ""))
+    return fig
+
+
+def format_amount(value):
+    return f"{value:,.0f}".replace(',', ' ')
+
+
+def income_marks(scenarios):
+    # Подписи ползунка: пять точек сетки
+    return {float(income): format_amount(income)
+            for income in scenarios.incomes[np.linspace(0, len(scenarios.incomes) - 1, 5).astype(int)]}
+
+
+def build_income_plot(scenarios):
+    income_fig = go.Figure()
+    income_fig.add_trace(go.Bar(
+        x=scenarios.months,
+        y=scenarios.obligations,
+        name='Ежемесячные платежи'
+    ))
+    # Кривая ПДН и месяцы превышения порога заполняются по выбранному доходу (apply_income)
+    income_fig.add_trace(go.Scatter(
+        x=scenarios.months,
+        y=[],
+        name='ПДН',
+        yaxis='y2',
+        line={'color': '#4B0082'}
+    ))
+    income_fig.add_trace(go.Scatter(
+        x=[],
+        y=[],
+        mode='markers',
+        name='ПДН выше порога',
+        yaxis='y2',
+        marker={'color': 'red', 'size': 6}
+    ))
+    income_fig.update_layout(
+        title="Платежи vs Доход",
+        yaxis={'title': 'Платежи в месяц'},
+        yaxis2={'title': 'ПДН', 'overlaying': 'y', 'side': 'right', 'tickformat': '.0%', 'rangemode': 'tozero'},
+        shapes=[{'type': 'line', 'xref': 'x domain', 'yref': 'y2', 'x0': 0, 'x1': 1,
+                 'y0': scenarios.threshold, 'y1': scenarios.threshold, 'line': {'color': 'red', 'dash': 'dash'}}]
     )
+    return income_fig
+
+
+def build_loan_pies(filtered_data):
+    filtered_df = get_filtered_df(filtered_data)
+    # Заглушки для пустых данных
     if filtered_df.empty:
-        return empty_fig, empty_fig, [], empty_fig
+        return no_data_figure(), no_data_figure()
+
+    import plotly.express as px  # загружается при первой фигуре, а не при запуске
 
-    # Круговые диаграммы
     loan_kind_fig = px.pie(
         filtered_df,
         names='trade_loan_kind_code',
         values='account_amt_credit_limit',
         title='Распределение по видам займов',
         hole=0.6  # Добавьте этот параметр для создания кольца
-    ).update_layout(
-        font_family='Verdana',
-        font_color=corporate_colors['text'],
-        plot_bgcolor=corporate_colors['card'],
-        paper_bgcolor=corporate_colors['background'],
-        title_font_size=18,
-        title_font_color='#5D3FBA'
     )
 
     loan_purpose_fig = px.pie(
@@ -470,71 +941,59 @@ def update_additional_elements(filtered_data, n_clicks, income):
         values='account_amt_credit_limit',
         title='Распределение по целям кредитов',
         hole=0.6  # Добавьте этот параметр
-    ).update_layout(
-        font_family='Verdana',
-        font_color=corporate_colors['text'],
-        plot_bgcolor=corporate_colors['card'],
-        paper_bgcolor=corporate_colors['background'],
-        title_font_size=18,
-        title_font_color='#5D3FBA'
     )
 
-    # Таблица с задолженностью
-    arrear_df = filtered_df[filtered_df['arrear_sign'] == 1]
-    table_data = arrear_df[[
-        'account_uid', 'arrear_amt_outstanding',
-        'arrear_calc_date', 'due_arrear_start_dt', 'past_due_amt_past_due', 'overall_val_credit_total_amt'
-    ]].to_dict('records')
-
-    # График с доходом
-    income_fig = go.Figure()
-    if n_clicks > 0 and income is not None and not filtered_df.empty and 'fund_date' in filtered_df.columns:
-        monthly_debt = filtered_df.resample('M', on='fund_date')['account_amt_credit_limit'].mean()
-        income_fig.add_trace(go.Scatter(
-            x=monthly_debt.index,
-            y=monthly_debt.values,
-            name='Средняя задолженность'
-        ))
-        income_fig.add_hline(
-            y=income,
-            line_dash="dash",
-            line_color="red",
-            annotation_text=f"Доход: {income}"
-        )
-        income_fig.update_layout(
-            title="Задолженность vs Доход",
-            plot_bgcolor=corporate_colors['card'],
-            paper_bgcolor=corporate_colors['background'],
-            font_color=corporate_colors['text']
-        )
-    else:
-        income_fig = empty_fig.update_layout(title="Задолженность vs Доход")
-
-    return loan_kind_fig, loan_purpose_fig, table_data, income_fig
+    return loan_kind_fig, loan_purpose_fig
 
 # В колбэки добавьте:
 @callback(
     Output('payment-schedule', 'figure'),
-    Input('crossfilter-selection', 'data')
+    [Input('crossfilter-selection', 'data'),
+     Input('payment-schedule', 'relayoutData')]
 )
-def update_payment_chart(filtered_data):
-    filtered_df = pd.read_json(filtered_data, orient='split')
+@metrics.track_callback
+def update_payment_chart(filtered_data, relayout_data):
+    # При увеличении диапазона точки перезапрашиваются с сервера в более подробном разрешении
+    x_range = zoom_range('payment-schedule', relayout_data)
+    if x_range is None:
+        return dash.no_update
+    return figure_cache.get_or_build(figure_key('payment-schedule', filtered_data, x_range),
+                                     lambda: build_payment_chart(filtered_data, x_range))
+
+
+def build_payment_chart(filtered_data, x_range=()):
+    filtered_df = get_filtered_df(filtered_data)
+    cash_flows = get_cash_flows(filtered_data)
 
     fig = go.Figure()
 
+    # Прогноз помесячного потока платежей по открытым кредитам
+    fig.add_trace(go.Bar(
+        x=cash_flows['month'],
+        y=cash_flows['principal'],
+        name='Прогноз: основной долг',
+        marker_color='#C9B9FC'
+    ))
+    fig.add_trace(go.Bar(
+        x=cash_flows['month'],
+        y=cash_flows['interest'],
+        name='Прогноз: проценты',
+        marker_color='#E5DEFF'
+    ))
+
     # Добавляем платежи по основному долгу
-    fig.add_trace(go.Scatter(
-        x=filtered_df['paymnt_condition_principal_terms_amt_dt'],
-        y=filtered_df['paymnt_condition_principal_terms_amt'],
-        mode='markers',
+    fig.add_trace(marker_trace(
+        filtered_df['paymnt_condition_principal_terms_amt_dt'],
+        filtered_df['paymnt_condition_principal_terms_amt'],
+        x_range,
         name='Основной долг',
         marker_color='#7E5BEF'
     ))
     # Добавляем платежи по процентам
-    fig.add_trace(go.Scatter(
-        x=filtered_df['paymnt_condition_interest_terms_amt_dt'],
-        y=filtered_df['paymnt_condition_interest_terms_amt'],
-        mode='markers',
+    fig.add_trace(marker_trace(
+        filtered_df['paymnt_condition_interest_terms_amt_dt'],
+        filtered_df['paymnt_condition_interest_terms_amt'],
+        x_range,
         name='Проценты',
         marker_color='#A389F4'
     ))
@@ -543,9 +1002,11 @@ def update_payment_chart(filtered_data):
         title="График платежей",
         xaxis_title="Дата платежа",
         yaxis_title="Сумма",
-        plot_bgcolor=corporate_colors['card'],
-        paper_bgcolor=corporate_colors['background']
+        barmode='stack',
+        uirevision=filtered_data['key']  # увеличение сохраняется, пока не сменилась выборка
     )
+    if x_range:
+        fig.update_xaxes(range=list(x_range))
 
     return fig
 
@@ -588,29 +1049,38 @@ def create_kpi_card(title, value, color):
      Output('dynamic-line', 'figure')],
     [Input('crossfilter-selection', 'data')]
 )
+@metrics.track_callback
 def update_graphs(filtered_data):
-    filtered_df = pd.read_json(filtered_data, orient='split')
+    return figure_cache.get_or_build(figure_key('year-graphs', filtered_data),
+                                     lambda: build_graphs(filtered_data))
 
-    if filtered_df.empty:
+
+def build_graphs(filtered_data):
+    import plotly.express as px
+
+    agg_cube = get_dataset(filtered_data['filters']).agg_cube
+    cells = agg_cube.slice(filter_conditions(filtered_data['filters']))
+
+    if cells.empty:
         return [
-            px.scatter(title="Нет данных"),
-            px.scatter(title="Нет данных"),
-            px.scatter(title="Нет данных"),
-            px.scatter(title="Нет данных")
+            no_data_figure(),
+            no_data_figure(),
+            no_data_figure(),
+            no_data_figure()
         ]
 
-    # Группировка данных
-    loans_by_year = filtered_df.groupby(["year", "account_amt_currency_code", "client_id"]).agg(
-        total_amount=("account_amt_credit_limit", "sum"),
-        loan_count=("account_amt_credit_limit", "count")
-    ).reset_index()
+    # Группировка данных: свертка среза куба
+    loans_by_year = agg_cube.rollup(cells, ["year", "account_amt_currency_code", "client_id"]).rename(columns={
+        "account_amt_credit_limit_sum": "total_amount",
+        "account_amt_credit_limit_count": "loan_count"
+    })
 
-    closed_stats = filtered_df[filtered_df['loan_indicator'] == 1].groupby("year").agg(
-        closed_count=("account_amt_credit_limit", "count"),
-        closed_amount=("account_amt_credit_limit", "sum"),
-        avg_pct_cost=("overall_val_credit_total_amt", "mean"),
-        total_monetary_cost=("overall_val_credit_total_monetary_amt", "sum")
-    ).reset_index()
+    closed_stats = agg_cube.rollup(cells[cells['loan_indicator'] == 1], "year").rename(columns={
+        "account_amt_credit_limit_count": "closed_count",
+        "account_amt_credit_limit_sum": "closed_amount",
+        "overall_val_credit_total_amt_mean": "avg_pct_cost",
+        "overall_val_credit_total_monetary_amt_sum": "total_monetary_cost"
+    })
 
     # Создание графиков
     fig1 = px.bar(
@@ -619,7 +1089,6 @@ def update_graphs(filtered_data):
         x="year",
         y="total_amount",
         color="account_amt_currency_code",
-        color_discrete_sequence=corporate_colors['colorscale'],
         title="Общая сумма кредитов",
         custom_data=["account_amt_currency_code"]
     )
@@ -629,7 +1098,6 @@ def update_graphs(filtered_data):
         x="year",
         y="loan_count",
         color="account_amt_currency_code",
-        color_discrete_sequence=corporate_colors['colorscale'],
         title="Количество кредитов",
         custom_data=["account_amt_currency_code"]
     )
@@ -640,7 +1108,6 @@ def update_graphs(filtered_data):
         y="avg_pct_cost",
         size="total_monetary_cost",
         color="closed_count",
-        color_continuous_scale=corporate_colors['colorscale'],
         title="Стоимость погашенных кредитов"
     )
 
@@ -648,85 +1115,149 @@ def update_graphs(filtered_data):
         closed_stats,
         x="year",
         y=["closed_amount", "total_monetary_cost"],
-        color_discrete_sequence=corporate_colors['colorscale'],
         title="Динамика погашений"
     )
 
-    # Обновление стилей
-    for fig in [fig1, fig2, fig3, fig4]:
-        fig.update_layout(
-            font_family='Verdana',
-            font_color=corporate_colors['text'],
-            plot_bgcolor=corporate_colors['card'],
-            paper_bgcolor=corporate_colors['background'],
-            title_font_size=18,
-            title_font_color='#5D3FBA'
-        )
-
     return fig1, fig2, fig3, fig4
 
 
 @callback(
     Output('cumulative-debt', 'figure'),
-    [Input('crossfilter-selection', 'data')]
+    [Input('crossfilter-selection', 'data'),
+     Input('cumulative-debt', 'relayoutData')]
 )
-def update_cumulative_debt(filtered_data):
-    filtered_df = pd.read_json(filtered_data, orient='split')
+@metrics.track_callback
+def update_cumulative_debt(filtered_data, relayout_data):
+    x_range = zoom_range('cumulative-debt', relayout_data)
+    if x_range is None:
+        return dash.no_update
+    return figure_cache.get_or_build(figure_key('cumulative-debt', filtered_data, x_range),
+                                     lambda: build_cumulative_debt(filtered_data, x_range))
 
-    if filtered_df.empty:
-        return px.line(title="Нет данных")
-
-    # Создаем DataFrame событий
-    events = []
-    for _, row in filtered_df.iterrows():
-        if pd.notnull(row['fund_date']):
-            events.append({
-                'date': row['fund_date'],
-                'amount': row['account_amt_credit_limit'] + row['overall_val_credit_total_monetary_amt'],
-                'type': 'issue'
-            })
-        if pd.notnull(row['loan_indicator_dt']) and row['loan_indicator'] == 1:
-            events.append({
-                'date': row['loan_indicator_dt'],
-                'amount': -(row['account_amt_credit_limit'] + row['overall_val_credit_total_monetary_amt']),
-                'type': 'repayment'
-            })
-
-    df_events = pd.DataFrame(events)
+
+def build_cumulative_debt(filtered_data, x_range=()):
+    # События уже отсортированы по дате, для выборки берем подмножество и пересчитываем нарастающий итог
+    dataset, positions = select_positions(filtered_data)
+    df_events = dataset.debt_events.series(positions)
 
     if df_events.empty:
-        return px.line(title="Нет данных")
+        return no_data_figure()
 
-    # Сортируем по дате и считаем нарастающий итог
-    df_events = df_events.sort_values('date')
-    df_events['cumulative'] = df_events['amount'].cumsum()
+    # События отсортированы по дате: берем окно увеличения и прореживаем линию с сохранением формы (LTTB)
+    dates = df_events['date'].to_numpy()
+    cumulative = df_events['cumulative'].to_numpy()
+    lo, hi = window(dates, *x_range) if x_range else (0, len(dates))
+    dates, cumulative = dates[lo:hi], cumulative[lo:hi]
+    points = lttb(dates, cumulative)
+    trace = go.Scattergl if len(dates) > THRESHOLD else go.Scatter
 
     # Создаем график
-    fig = px.line(
-        df_events,
-        x='date',
-        y='cumulative',
-        title='Динамика общей задолженности',
-        color_discrete_sequence=[corporate_colors['colorscale'][0]]
-    )
+    fig = go.Figure(trace(
+        x=dates[points],
+        y=cumulative[points],
+        mode='lines',
+        name='Задолженность'
+    ))
 
     fig.update_layout(
-        font_family='Verdana',
-        font_color=corporate_colors['text'],
-        plot_bgcolor=corporate_colors['card'],
-        paper_bgcolor=corporate_colors['background'],
-        title_font_size=18,
-        title_font_color='#5D3FBA',
+        title='Динамика общей задолженности',
+        uirevision=filtered_data['key'],
         xaxis_title="Дата",
         yaxis_title="Сумма задолженности",
         yaxis_tickformat=",.0f"
     )
+    if x_range:
+        fig.update_xaxes(range=list(x_range))
 
     return fig
 
-def send_prompt_to_llm(kpi_data: dict, giga_token):
 
-    credentials = giga_token  # Замените на реальные учетные данные
+@callback(
+    Output('delinquency-heatmap', 'figure'),
+    [Input('crossfilter-selection', 'data')]
+)
+@metrics.track_callback
+def update_delinquency_heatmap(filtered_data):
+    return figure_cache.get_or_build(figure_key('delinquency-heatmap', filtered_data),
+                                     lambda: build_delinquency_heatmap(filtered_data))
+
+
+def build_delinquency_heatmap(filtered_data):
+    # Матрица историй платежей декодирована при загрузке, для выборки только считаем состояния по месяцам
+    dataset, positions = select_positions(filtered_data)
+    counts = dataset.payment_history.status_counts(positions)
+    labels = PaymentHistory.status_labels(mapping_registry.get().codes.get('attr_value', {}))
+
+    present = counts.sum(axis=1) > 0
+    if not present.any():
+        return no_data_figure()
+
+    fig = go.Figure(go.Heatmap(
+        x=dataset.payment_history.months,
+        y=[label for label, shown in zip(labels, present) if shown],
+        z=counts[present],
+        colorscale=corporate_colors['colorscale'][::-1],
+        hovertemplate="%{x|%m.%Y}<br>%{y}<br>Кредитов: %{z}<extra></extra>"
+    ))
+
+    fig.update_layout(
+        title='История просрочек по месяцам',
+        xaxis_title="Месяц",
+        yaxis_title="Состояние"
+    )
+
+    return fig
+
+@callback(
+    Output('key-rate-overlay', 'figure'),
+    [Input('crossfilter-selection', 'data')]
+)
+@metrics.track_callback
+def update_key_rate_overlay(filtered_data):
+    # Ряд ставки обновляется в фоне - дата последнего значения входит в ключ
+    return figure_cache.get_or_build(figure_key('key-rate-overlay', filtered_data, key_rate_service.latest()['date']),
+                                     lambda: build_key_rate_overlay(filtered_data))
+
+
+def build_key_rate_overlay(filtered_data):
+    filtered_df = get_filtered_df(filtered_data)
+    loans = filtered_df.dropna(subset=['fund_date', 'overall_val_credit_total_amt'])
+
+    if loans.empty:
+        return no_data_figure()
+
+    # Ставка ЦБ за период выдачи кредитов выборки - из памяти сервиса, без обращения к сети
+    rates = key_rate_service.series(loans['fund_date'].min(), None)
+
+    fig = go.Figure()
+    fig.add_trace(go.Scatter(
+        x=loans['fund_date'],
+        y=loans['overall_val_credit_total_amt'],
+        mode='markers',
+        name='ПСК кредита',
+        marker_color='#A389F4'
+    ))
+    fig.add_trace(go.Scatter(
+        x=rates['date'],
+        y=rates['rate'],
+        mode='lines',
+        line_shape='hv',
+        name='Ключевая ставка ЦБ',
+        line=dict(color='#4B0082', width=2)
+    ))
+
+    fig.update_layout(
+        title='ПСК кредитов и ключевая ставка ЦБ',
+        xaxis_title="Дата выдачи",
+        yaxis_title="Ставка, % годовых",
+        yaxis_type='log'
+    )
+
+    return fig
+
+def send_prompt_to_llm(kpi_data: dict, giga_token):
+    key_rate = key_rate_service.latest()
+    key_rate_text = f"{key_rate['rate']:.1f}".replace('.', ',') if isinstance(key_rate['rate'], float) else key_rate['rate']
 
     prompt = f"""
     Анализ параметров кредитной истории:
@@ -737,14 +1268,15 @@ def send_prompt_to_llm(kpi_data: dict, giga_token):
 
     Задача: 1. Дать развернутый анализ по каждому параметру. Дать конкретные рекомендации по каждому параметру для заемщика по улучшению. 
             2. Ответ оформить как маркированный список.
-            3. Указать среднюю процентную ставку потребительского кредитованя в банках : (на текущую дату {datetime.now()} составляет 21,0%+ 7%/15%)
+            3. Указать среднюю процентную ставку потребительского кредитованя в банках : (на текущую дату {datetime.now():%d.%m.%Y} составляет {key_rate_text}%+ 7%/15%, ключевая ставка ЦБ на {key_rate['date']})
             Расчет не выводить!"
          
     """
-    prompt += f"\n\nДополнительный контекст маппинга:\n{mapping_df.iloc[:, 4].to_string()}"
+    mapping_context = mapping_registry.get().prompt_context(['trade_loan_kind_code', 'trade_acct_type1'])
+    prompt += f"\n\nДополнительный контекст маппинга:\n{mapping_context}"
 
-    with GigaChat(credentials=credentials, verify_ssl_certs=False) as giga:
-        return giga.chat(prompt)
+    # Промпт детерминирован для одинаковых KPI (дата - с точностью до дня), повторы берем из кэша
+    return llm_cache.get_or_compute(prompt_key(prompt), lambda: llm_chat('recommendation', prompt))
 
 
 if __name__ == '__main__':
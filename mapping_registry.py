@@ -0,0 +1,107 @@
+import csv
+import os
+import re
+import threading
+
+import numpy as np
+import pandas as pd
+
+
+# Строка справочника внутри описания: «1 - Заемщик», «2.1 Приобретение ...», «1<TAB>Заем (кредит)», «A Просрочка ...»
+CODE_LINE = re.compile(r'^\s*([0-9]+(?:\.[0-9]+)*|[A-ZА-ЯЁ]|[-–])\s*(?:[-–]\s+|\t|\s+)(\S.*)$')
+# Кириллические буквы, которые в справочнике встречаются вместо латинских кодов (С вместо C)
+HOMOGLYPHS = str.maketrans('АВСЕНКМОРТХ–', 'ABCEHKMOPTX-')
+
+
+def _parse_code(raw):
+    raw = raw.strip()
+    try:
+        return float(raw)  # Числовые коды храним как float: 2.1, 4.5 и 1 сравниваются одинаково
+    except ValueError:
+        return raw.translate(HOMOGLYPHS)
+
+
+def _parse_codes(text):
+    codes = {}
+    for line in str(text).split("\n"):
+        match = CODE_LINE.match(line)
+        if match:
+            codes[_parse_code(match.group(1))] = match.group(2).strip()
+    return codes
+
+
+# Разобранный справочник maping_csv.csv: описания колонок и все словари кодов из описаний
+class MappingTables:
+    def __init__(self, path):
+        self.descriptions = {}  # колонка -> полное описание
+        self.codes = {}  # колонка -> {код: расшифровка}
+        self._arrays = {}  # колонка -> (отсортированные числовые коды, расшифровки)
+        self._contexts = {}  # готовые тексты справочников для промптов
+        with open(path, encoding='utf-8-sig', newline='') as f:
+            for row in csv.reader(f, delimiter=';'):
+                if len(row) < 4:
+                    continue
+                field = re.sub("['\",]", "", row[2]).strip()
+                if not field or field == 'Поле':
+                    continue
+                self.descriptions[field] = row[3].strip()
+                # Дополнительная колонка с более полным справочником (строки trade_loan_kind_code, trade_acct_type1)
+                codes = {**_parse_codes(row[3]), **_parse_codes(row[4] if len(row) > 4 else '')}
+                if codes:
+                    self.codes[field] = codes
+        for column, codes in self.codes.items():
+            numeric = sorted(code for code in codes if isinstance(code, float))
+            if numeric:
+                self._arrays[column] = (np.array(numeric, dtype=float),
+                                        np.array([codes[code] for code in numeric], dtype=object))
+
+    def title(self, column):
+        # Первая строка описания - русское название параметра
+        return self.descriptions.get(column, column).split("\n")[0]
+
+    def translate(self, column, series):
+        # Векторная замена числовых кодов на расшифровки, незнакомые коды -> NaN (как Series.map)
+        codes, labels = self._arrays[column]
+        values = pd.to_numeric(series, errors='coerce').to_numpy(dtype=float)
+        positions = np.clip(np.searchsorted(codes, values), 0, len(codes) - 1)
+        matched = codes[positions] == values
+        return pd.Series(np.where(matched, labels[positions], np.nan), index=series.index, name=series.name)
+
+    def prompt_context(self, columns):
+        # Справочники кодов в компактном виде для промпта, текст собирается один раз
+        columns = tuple(columns)
+        if columns not in self._contexts:
+            self._contexts[columns] = self._build_context(columns)
+        return self._contexts[columns]
+
+    def _build_context(self, columns):
+        blocks = []
+        for column in columns:
+            codes = self.codes.get(column)
+            if codes:
+                lines = "\n".join(f"{code:g} - {label}" if isinstance(code, float) else f"{code} - {label}"
+                                  for code, label in codes.items())
+                blocks.append(f"{self.title(column)} ({column}):\n{lines}")
+        return "\n\n".join(blocks)
+
+
+# Реестр справочника: разбирает файл один раз и перечитывает только при изменении mtime
+class MappingRegistry:
+    def __init__(self, path):
+        self.path = path
+        self.version = 0
+        self._mtime = None
+        self._tables = None
+        self._lock = threading.Lock()
+        # Разбор сразу при создании: версия справочника входит в ключи кэшей и не должна меняться при первом обращении
+        self.get()
+
+    def get(self):
+        mtime = os.stat(self.path).st_mtime_ns
+        if mtime != self._mtime:
+            with self._lock:
+                if mtime != self._mtime:
+                    self._tables = MappingTables(self.path)
+                    self._mtime = mtime
+                    self.version += 1
+        return self._tables
@@ -0,0 +1,202 @@
+import cProfile
+import functools
+import os
+import threading
+import time
+from collections import defaultdict
+
+import plotly.io.json as plotly_json
+from flask import Response, g, request
+
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+BYTES_BUCKETS = (1024, 10 * 1024, 100 * 1024, 512 * 1024, 1024 ** 2, 5 * 1024 ** 2, 20 * 1024 ** 2)
+
+
+def _labels(labels):
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}' if labels else ''
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self._series = defaultdict(lambda: [[0] * len(buckets), 0.0, 0])  # метки -> (корзины, сумма, количество)
+
+    def observe(self, value, **labels):
+        series = self._series[tuple(sorted(labels.items()))]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[0][i] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        for labels, (counts, total, count) in sorted(self._series.items()):
+            for bound, bucket_count in zip(self.buckets, counts):
+                lines.append(f'{self.name}_bucket{_labels(labels + (("le", f"{bound:g}"),))} {bucket_count}')
+            lines.append(f'{self.name}_bucket{_labels(labels + (("le", "+Inf"),))} {count}')
+            lines.append(f'{self.name}_sum{_labels(labels)} {total:.6f}')
+            lines.append(f'{self.name}_count{_labels(labels)} {count}')
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self._series = defaultdict(float)
+
+    def inc(self, amount=1, **labels):
+        self._series[tuple(sorted(labels.items()))] += amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        lines.extend(f'{self.name}{_labels(labels)} {value:g}' for labels, value in sorted(self._series.items()))
+        return lines
+
+
+# Метрики приложения в текстовом формате Prometheus (без зависимости от prometheus_client).
+# Колбэки оборачиваются декоратором track_callback, запросы Dash замеряются хуками Flask,
+# вызовы LLM - контекстом llm_call. Значения - на процесс (воркер gunicorn).
+class Metrics:
+    def __init__(self, profile_dir=None):
+        self._lock = threading.Lock()
+        self.callback_seconds = Histogram('dash_callback_seconds', "Время выполнения колбэка Dash", SECONDS_BUCKETS)
+        self.callback_errors = Counter('dash_callback_errors_total', "Исключения в колбэках Dash")
+        self.request_seconds = Histogram('dash_request_seconds', "Полное время запроса /_dash-update-component",
+                                         SECONDS_BUCKETS)
+        self.payload_bytes = Histogram('dash_payload_bytes', "Размер входа/выхода колбэка в байтах", BYTES_BUCKETS)
+        self.decode_seconds = Histogram('dash_json_decode_seconds', "Разбор JSON запроса колбэка", SECONDS_BUCKETS)
+        self.encode_seconds = Histogram('dash_json_encode_seconds', "Сериализация ответа колбэка в JSON",
+                                        SECONDS_BUCKETS)
+        self.llm_seconds = Histogram('llm_call_seconds', "Время запроса к GigaChat", SECONDS_BUCKETS)
+        self.llm_errors = Counter('llm_call_errors_total', "Ошибки запросов к GigaChat")
+        self._collectors = []  # функции -> [(имя, тип, описание, {метки}, значение)]
+        # Профилирование запроса по заголовку X-Profile: 1, включается заданием папки для профилей
+        self.profile_dir = profile_dir
+
+    def track_callback(self, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                with self._lock:
+                    self.callback_errors.inc(callback=func.__name__)
+                raise
+            finally:
+                elapsed = time.perf_counter() - started
+                with self._lock:
+                    self.callback_seconds.observe(elapsed, callback=func.__name__)
+                try:
+                    g.callback_name = func.__name__
+                    g.callback_seconds = elapsed
+                except RuntimeError:
+                    pass  # вызов вне запроса (бенчмарк, тесты)
+        return wrapper
+
+    def llm_call(self, kind):
+        return _LLMCall(self, kind)
+
+    def add_collector(self, collector):
+        self._collectors.append(collector)
+
+    def instrument(self, server, route='/metrics'):
+        _time_json_encoding()
+        server.before_request(self._before_request)
+        server.after_request(self._after_request)
+        server.add_url_rule(route, 'metrics', self._serve)
+
+    def _before_request(self):
+        if request.path.endswith('/_dash-update-component'):
+            g.metrics_started = time.perf_counter()
+            # Тело разбирается здесь, Dash берет уже разобранный JSON из кэша запроса
+            started = time.perf_counter()
+            request.get_json(silent=True)
+            g.decode_seconds = time.perf_counter() - started
+        if self.profile_dir and request.headers.get('X-Profile') == '1':
+            g.profiler = cProfile.Profile()
+            g.profiler.enable()
+
+    def _after_request(self, response):
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            profiler.disable()
+            os.makedirs(self.profile_dir, exist_ok=True)
+            name = f"{time.strftime('%Y%m%d-%H%M%S')}-{g.get('callback_name', 'request')}-{id(profiler):x}.prof"
+            profiler.dump_stats(os.path.join(self.profile_dir, name))
+            response.headers['X-Profile-File'] = name
+        started = g.pop('metrics_started', None)
+        if started is not None and not response.direct_passthrough:
+            elapsed = time.perf_counter() - started
+            callback = g.get('callback_name', 'unknown')
+            with self._lock:
+                self.request_seconds.observe(elapsed, callback=callback)
+                self.decode_seconds.observe(g.get('decode_seconds', 0.0), callback=callback)
+                self.encode_seconds.observe(g.get('encode_seconds', 0.0), callback=callback)
+                self.payload_bytes.observe(request.content_length or 0, callback=callback, direction='in')
+                self.payload_bytes.observe(response.calculate_content_length() or 0, callback=callback,
+                                           direction='out')
+        return response
+
+    def render(self):
+        with self._lock:
+            lines = []
+            for metric in (self.callback_seconds, self.callback_errors, self.request_seconds, self.payload_bytes,
+                           self.decode_seconds, self.encode_seconds, self.llm_seconds, self.llm_errors):
+                lines.extend(metric.render())
+        described = set()
+        for collector in self._collectors:
+            for name, kind, help_text, labels, value in collector():
+                # Описание метрики - один раз, перед первым значением с любыми метками
+                if name not in described:
+                    described.add(name)
+                    lines.extend([f'# HELP {name} {help_text}', f'# TYPE {name} {kind}'])
+                lines.append(f'{name}{_labels(tuple(sorted(labels.items())))} {value:g}')
+        return '\n'.join(lines) + '\n'
+
+    def _serve(self):
+        return Response(self.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def _time_json_encoding():
+    # Dash сериализует ответ колбэка через plotly.io.json.to_json_plotly, импортируя его при каждом вызове:
+    # обертка в модуле plotly суммирует время сериализации в рамках запроса.
+    # Модули, импортировавшие функцию заранее (кэш фигур), обертку не получают - их время входит в колбэк
+    encode = plotly_json.to_json_plotly
+    if getattr(encode, 'timed', False):
+        return
+
+    @functools.wraps(encode)
+    def timed_encode(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return encode(*args, **kwargs)
+        finally:
+            try:
+                g.encode_seconds = g.get('encode_seconds', 0.0) + time.perf_counter() - started
+            except RuntimeError:
+                pass  # вызов вне запроса
+    timed_encode.timed = True
+    plotly_json.to_json_plotly = timed_encode
+
+
+class _LLMCall:
+    def __init__(self, metrics, kind):
+        self.metrics = metrics
+        self.kind = kind
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        with self.metrics._lock:
+            self.metrics.llm_seconds.observe(time.perf_counter() - self.started, kind=self.kind)
+            if exc_type is not None:
+                self.metrics.llm_errors.inc(kind=self.kind)
+        return False
@@ -0,0 +1,141 @@
+import json
+import os
+import pickle
+import shutil
+import sys
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from dataset import Dataset
+from ingest import ingest
+from schema import apply_schema
+from storage import data_sources, locked_manifest, read_manifest
+
+
+# Хранилище выгрузки, разбитой по client_id: клиенты разложены по фиксированному числу файлов-корзин
+# (client_id % buckets), число файлов не растет с числом клиентов. Список клиентов и смещения их строк
+# в корзине берутся из легкого манифеста, данные клиента читаются только при выборе
+# и держатся в памяти в LRU с ограничением по объему.
+class PartitionStore:
+    def __init__(self, source_path, mapping_registry, directory='partitions', max_bytes=512 * 1024 * 1024,
+                 chunksize=200_000, buckets=256):
+        self.source_path = source_path
+        self.mapping_registry = mapping_registry
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.chunksize = chunksize
+        self.buckets = buckets
+        self._manifest = None
+        self._resident = OrderedDict()  # client_id -> Dataset
+        self._lock = threading.Lock()
+        self._manifest_lock = threading.Lock()  # отдельно от _lock: build() берет _lock сам
+
+    @property
+    def manifest_path(self):
+        return os.path.join(self.directory, 'manifest.json')
+
+    def _sources(self):
+        # Число корзин входит в отпечаток: при его смене раскладка по файлам другая
+        return data_sources(self.source_path, self.mapping_registry.path, buckets=self.buckets)
+
+    def manifest(self):
+        if self._manifest is None:
+            with self._manifest_lock:
+                if self._manifest is None:
+                    self._manifest = locked_manifest(self.manifest_path, self._sources(), self.directory + '.lock',
+                                                     self.build)
+        return self._manifest
+
+    def prepared(self):
+        # Манифест без построения: None, если разбиение еще не готово (строится при запуске или заранее)
+        if self._manifest is None:
+            manifest = read_manifest(self.manifest_path, self._sources())
+            if manifest is not None:
+                with self._manifest_lock:
+                    self._manifest = self._manifest or manifest
+        return self._manifest
+
+    def clients(self):
+        return [entry['client_id'] for entry in self.manifest()['clients']]
+
+    def bucket_path(self, bucket, directory=None):
+        return os.path.join(directory or self.directory, f'bucket-{bucket:04d}.pkl')
+
+    def build(self):
+        mapping_tables = self.mapping_registry.get()
+        tmp_directory = self.directory + '.tmp'
+        shutil.rmtree(tmp_directory, ignore_errors=True)
+        os.makedirs(tmp_directory)
+        entries = {}
+
+        def write_parts(chunk_number, chunk):
+            chunk = chunk[chunk['client_id'].notna()]
+            client_ids = chunk['client_id'].to_numpy(dtype=np.int64)
+            # Строки куска раскладываются по корзинам client_id % buckets: одна дозапись на корзину,
+            # в манифесте у клиента - корзина и смещения кадров, в которых есть его строки
+            for bucket, part in chunk.groupby(client_ids % self.buckets, sort=False):
+                with open(self.bucket_path(bucket, tmp_directory), 'ab') as f:
+                    offset = f.tell()
+                    pickle.dump(part.reset_index(drop=True), f, protocol=pickle.HIGHEST_PROTOCOL)
+                for client_id, rows in part['client_id'].value_counts(sort=False).items():
+                    client_id = int(client_id)
+                    entry = entries.setdefault(client_id, {'client_id': client_id, 'bucket': int(bucket),
+                                                           'rows': 0, 'offsets': []})
+                    entry['rows'] += int(rows)
+                    entry['offsets'].append(offset)
+
+        # Выгрузка читается потоково, в памяти одновременно только один кусок
+        # Куб и строки с задолженностью разбиению не нужны - только запись частей
+        _, report = ingest(self.source_path, mapping_tables, self.chunksize, consumers=[write_parts],
+                           aggregates=False)
+        manifest = {'sources': self._sources(), 'ingest': report,
+                    'clients': sorted(entries.values(), key=lambda e: e['client_id'])}
+        with open(os.path.join(tmp_directory, 'manifest.json'), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f)
+        shutil.rmtree(self.directory, ignore_errors=True)
+        os.replace(tmp_directory, self.directory)
+        with self._lock:
+            self._resident.clear()
+        return manifest
+
+    def load(self, client_id):
+        with self._lock:
+            dataset = self._resident.get(client_id)
+            if dataset is not None:
+                self._resident.move_to_end(client_id)
+                return dataset
+        entry = next((e for e in self.manifest()['clients'] if e['client_id'] == client_id), None)
+        if entry is None:
+            raise KeyError(client_id)
+        parts = []
+        with open(self.bucket_path(entry['bucket']), 'rb') as f:
+            for offset in entry['offsets']:
+                f.seek(offset)
+                frame = pickle.load(f)
+                parts.append(frame[frame['client_id'] == client_id])
+        # Категории частей из разных кусков выгрузки различаются: после склейки типы восстанавливаются по схеме
+        dataset = Dataset(apply_schema(pd.concat(parts, ignore_index=True)) if len(parts) > 1
+                          else parts[0].reset_index(drop=True))
+        with self._lock:
+            if client_id not in self._resident:
+                self._resident[client_id] = dataset
+            # Структуры раздела строятся лениво, уже после загрузки: объем пересчитывается при каждой загрузке.
+            # Вытесняем давно не выбиравшихся клиентов, последний загруженный остается всегда
+            resident_bytes = sum(resident.nbytes for resident in self._resident.values())
+            while resident_bytes > self.max_bytes and len(self._resident) > 1:
+                _, evicted = self._resident.popitem(last=False)
+                resident_bytes -= evicted.nbytes
+        return dataset
+
+
+# Разбиение выгрузки заранее: python partition_store.py credits.csv [папка]
+if __name__ == '__main__':
+    from mapping_registry import MappingRegistry
+    store = PartitionStore(sys.argv[1], MappingRegistry("maping_csv.csv"),
+                           directory=sys.argv[2] if len(sys.argv) > 2 else 'partitions')
+    built = store.build()
+    print(f"Клиентов: {len(built['clients'])}, строк: {built['ingest']['rows']}, "
+          f"строк/с: {built['ingest']['rows_per_second']}, пик RSS: {built['ingest']['peak_rss_mb']} МБ")
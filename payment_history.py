@@ -0,0 +1,124 @@
+import json
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+from mapping_registry import HOMOGLYPHS
+from storage import locked_manifest
+
+
+# Состояния платежной строки attr_value в порядке тяжести: без просрочки, просрочки 1-9, A, B,
+# затем конечные состояния договора. Символ «-» и месяцы вне истории кредита - NO_DATA.
+STATUS_CHARS = '0123456789ABCSRWUTI'
+NO_DATA = -1
+# Строк за один шаг декодирования: временная матрица кодов символов (4 байта на символ) - только для куска
+DECODE_CHUNK = 65_536
+HISTORY_FILE = 'payment_history.npy'
+
+# Таблица перекодировки кода символа в код состояния, кириллические двойники латинских кодов учтены сразу.
+# Таблица на весь диапазон Unicode (1,1 МБ): код любого символа - сразу индекс, без проверки границ
+_LOOKUP = np.full(sys.maxunicode + 1, NO_DATA, dtype=np.int8)
+for _status, _char in enumerate(STATUS_CHARS):
+    _LOOKUP[ord(_char)] = _status
+for _source, _target in HOMOGLYPHS.items():
+    _LOOKUP[_source] = _LOOKUP[_target]
+
+
+def decode_strings(values, chunk_rows=DECODE_CHUNK):
+    # Строки -> матрица кодов символов фиксированной ширины -> коды состояний через таблицу (без циклов по строкам).
+    # Кусками строк: результат int8 пишется сразу в итоговую матрицу, память не растет с числом строк x4
+    values = pd.Series(values, dtype=object).fillna('').astype(str)
+    width = max(int(values.str.len().max()) if len(values) else 0, 1)
+    decoded = np.full((len(values), width), NO_DATA, dtype=np.int8)
+    for start in range(0, len(values), chunk_rows):
+        chunk = values.iloc[start:start + chunk_rows].to_numpy(dtype=str)
+        if chunk.dtype.itemsize == 0:
+            continue  # в куске только пустые строки
+        # Ширина dtype куска может быть больше длины строк (дополнение нулями) - лишнее отрезаем
+        chars = chunk.view(np.uint32).reshape(len(chunk), chunk.dtype.itemsize // 4)[:, :width]
+        # Дополнение нулевыми символами и незнакомые символы дают NO_DATA
+        decoded[start:start + len(chunk), :chars.shape[1]] = _LOOKUP[chars]
+    return decoded
+
+
+# История платежей по всем кредитам: матрица int8 (кредиты × календарные месяцы).
+# Первый символ строки - месяц отчета (reporting_dt), каждый следующий - на месяц раньше.
+class PaymentHistory:
+    def __init__(self, df):
+        decoded = decode_strings(df['attr_value'].to_numpy())
+        width = decoded.shape[1]
+        reporting = pd.to_datetime(df['reporting_dt'], errors='coerce')
+        # Номер месяца отчета от начала эпохи
+        report_month = (reporting.dt.year * 12 + reporting.dt.month - 1).to_numpy(dtype=float)
+        valid = ~np.isnan(report_month)
+        if not valid.any():
+            self.months = pd.DatetimeIndex([])
+            self.matrix = np.empty((len(df), 0), dtype=np.int8)
+            return
+        report_month = np.where(valid, report_month, np.nanmax(report_month)).astype(np.int64)
+        first = int(report_month.min()) - width + 1
+        last = int(report_month.max())
+        self.months = pd.date_range(pd.Timestamp(year=first // 12, month=first % 12 + 1, day=1),
+                                    periods=last - first + 1, freq='MS')
+        self.matrix = np.full((len(df), last - first + 1), NO_DATA, dtype=np.int8)
+        # Кредиты с одинаковым месяцем отчета сдвигаются одним блоком, строка разворачивается в хронологию
+        for month in np.unique(report_month[valid]):
+            rows = np.flatnonzero(valid & (report_month == month))
+            end = month - first + 1
+            self.matrix[rows, end - width:end] = decoded[rows, ::-1]
+
+    @classmethod
+    def from_matrix(cls, matrix, months):
+        history = cls.__new__(cls)
+        history.matrix = matrix
+        history.months = months
+        return history
+
+    def status_counts(self, positions=None, chunk_rows=DECODE_CHUNK):
+        # Количество кредитов в каждом состоянии по месяцам: (состояния × месяцы)
+        # Один bincount по паре (месяц, состояние) вместо прохода по матрице на каждое состояние;
+        # кусками строк: временные коды int64 (8 байт на ячейку) - только для куска, а не для всей выборки
+        states = len(STATUS_CHARS) + 1  # плюс NO_DATA
+        months = self.matrix.shape[1]
+        offsets = states * np.arange(months)
+        counts = np.zeros(states * months, dtype=np.int64)
+        rows = len(self.matrix) if positions is None else len(positions)
+        for start in range(0, rows, chunk_rows):
+            block = (self.matrix[start:start + chunk_rows] if positions is None
+                     else self.matrix[positions[start:start + chunk_rows]])
+            cells = block.astype(np.int64) - NO_DATA + offsets
+            counts += np.bincount(cells.ravel(), minlength=states * months)
+        return counts.reshape(months, states)[:, 1:].T
+
+    @staticmethod
+    def status_labels(codes):
+        # Расшифровки состояний из справочника (колонка attr_value)
+        return [codes.get(float(char) if char.isdigit() else char, char) for char in STATUS_CHARS]
+
+
+def load_payment_history(snapshot):
+    # Матрица портфеля строится один раз на версию снимка и хранится в его папке: воркеры отображают файл
+    # в память только для чтения и делят страницы, вместо своей копии (кредиты × месяцы) в каждом воркере
+    path = os.path.join(snapshot.directory, HISTORY_FILE)
+    sources = snapshot.open().sources
+
+    def build():
+        history = PaymentHistory(snapshot.load(['attr_value', 'reporting_dt']))
+        tmp_path = f'{path}.{os.getpid()}.tmp.npy'
+        np.save(tmp_path, history.matrix)
+        os.replace(tmp_path, path)
+        stored = {'sources': sources, 'months': len(history.months),
+                  'first': history.months[0].strftime('%Y-%m-%d') if len(history.months) else None}
+        # Описание пишется последним: пока его нет, матрица считается неготовой
+        with open(f'{path}.{os.getpid()}.tmp.json', 'w', encoding='utf-8') as f:
+            json.dump(stored, f)
+        os.replace(f'{path}.{os.getpid()}.tmp.json', path + '.json')
+        return stored
+
+    stored = locked_manifest(path + '.json', sources, snapshot.directory + '.history.lock', build)
+    if not stored['months']:
+        return PaymentHistory.from_matrix(np.load(path), pd.DatetimeIndex([]))
+    matrix = np.load(path, mmap_mode='r').view(np.ndarray)  # те же страницы, без подкласса memmap
+    return PaymentHistory.from_matrix(matrix, pd.date_range(stored['first'], periods=stored['months'], freq='MS'))
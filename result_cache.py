@@ -0,0 +1,59 @@
+import hashlib
+import json
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+
+# Ключ выборки: стабильный хэш от состояния фильтров
+def selection_key(filters: dict):
+    raw = json.dumps(filters, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+# Серверный кэш выборок: позиции строк выборки в рабочей таблице (а не копии строк)
+# и небольшие производные ряды по выборке. Значения хранятся в бинарном виде (pickle),
+# вытесняются по LRU и по времени жизни (TTL).
+class ResultCache:
+    def __init__(self, max_bytes=256 * 1024 * 1024, ttl=600):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._items = OrderedDict()  # key -> (время записи, байты)
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            stored_at, blob = item
+            if time.monotonic() - stored_at > self.ttl:
+                self._drop(key)
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+        # Каждый колбэк получает свою копию, кэш остается неизменным
+        return pickle.loads(blob)
+
+    def put(self, key, value):
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(blob) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._items:
+                self._drop(key)
+            self._items[key] = (time.monotonic(), blob)
+            self._size += len(blob)
+            # Вытесняем самые старые записи, пока не уложимся в лимит
+            while self._size > self.max_bytes:
+                self._drop(next(iter(self._items)))
+
+    def _drop(self, key):
+        _, blob = self._items.pop(key)
+        self._size -= len(blob)
@@ -0,0 +1,195 @@
+import argparse
+import multiprocessing
+import os
+import pickle
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+import pandas as pd
+
+from schema import COUNT_COLUMNS
+from snapshot import ColumnarSnapshot
+from storage import file_lock
+
+
+# Колонки снимка для признаков риска (читаются из снимка, в рабочую таблицу дашборда не входят)
+FEATURE_COLUMNS = ['client_id', 'loan_indicator', 'cred_max_overdue', 'arrear_amt_outstanding',
+                   'past_due_amt_past_due'] + COUNT_COLUMNS
+# Вес счетчика просрочек в оценке риска: чем длиннее просрочка, тем больше вес
+DELAY_WEIGHTS = {'delay5': 1, 'delay30': 2, 'delay60': 3, 'delay90': 4, 'delay_more': 5}
+AMOUNT_COLUMNS = ['cred_max_overdue', 'arrear_amt_outstanding', 'past_due_amt_past_due']
+# Шардов на процесс: мелкие шарды разбирают освободившиеся процессы, медленный шард не держит весь расчет
+SHARDS_PER_WORKER = 8
+# Меньше строк - считаем в одном процессе: запуск пула дороже самого расчета
+PARALLEL_MIN_ROWS = 1_000_000
+FEATURES_FILE = 'risk_features.pkl'
+# Предел времени этапа в отдельном процессе, после него - расчет в процессе дашборда
+STAGE_TIMEOUT = 600
+
+
+# Признаки клиентов по строкам выборки: суммы просрочек и долгов, максимум просрочки, открытые/закрытые кредиты
+def client_features(frame):
+    closed = frame['loan_indicator'].notna()
+    grouped = frame.assign(open_loans=~closed, closed_loans=closed).groupby('client_id', sort=False, observed=True)
+    features = grouped[COUNT_COLUMNS + ['open_loans', 'closed_loans', 'arrear_amt_outstanding',
+                                        'past_due_amt_past_due']].sum()
+    features['cred_max_overdue'] = grouped['cred_max_overdue'].max()
+    return features
+
+
+# Компактная таблица: счетчики int32, оценка риска float32, клиенты по убыванию риска
+def finish_features(features):
+    features = features.fillna({column: 0.0 for column in AMOUNT_COLUMNS})
+    counts = COUNT_COLUMNS + ['open_loans', 'closed_loans']
+    features[counts] = features[counts].astype(np.int32)
+    features.insert(0, 'loans', (features['open_loans'] + features['closed_loans']).astype(np.int32))
+    weighted = sum(features[column] * weight for column, weight in DELAY_WEIGHTS.items())
+    features.insert(0, 'risk_score', (weighted / features['loans'].clip(lower=1)).astype(np.float32))
+    # Равные оценки - по client_id, порядок не зависит от разбиения на шарды
+    features = features.sort_index().sort_values(['risk_score', 'past_due_amt_past_due', 'cred_max_overdue'],
+                                                 ascending=False, kind='stable')
+    return features[['risk_score', 'loans', 'open_loans', 'closed_loans'] + COUNT_COLUMNS + AMOUNT_COLUMNS]
+
+
+def shard_positions(client_ids, shards):
+    # Позиции строк, упорядоченные по клиенту и разрезанные на шарды примерно равного размера
+    # по границам клиентов (клиент целиком в одном шарде); крупные шарды - первыми
+    codes, _ = pd.factorize(client_ids, use_na_sentinel=False)
+    order = np.argsort(codes, kind='stable')
+    starts = np.flatnonzero(np.diff(codes[order])) + 1
+    if len(starts) == 0 or shards <= 1:
+        return [order]
+    targets = np.arange(1, shards) * len(order) / shards
+    cuts = np.unique(starts[np.minimum(np.searchsorted(starts, targets), len(starts) - 1)])
+    return sorted(np.split(order, cuts), key=len, reverse=True)
+
+
+# Процесс пула отображает снимок сам: в задачу передаются только позиции строк шарда
+_worker_frame = None
+
+
+def _init_worker(source_path, mapping_path, directory):
+    global _worker_frame
+    from mapping_registry import MappingRegistry
+    _worker_frame = ColumnarSnapshot(source_path, MappingRegistry(mapping_path), directory).load(FEATURE_COLUMNS)
+
+
+def _shard_features(positions):
+    return client_features(_worker_frame.take(positions))
+
+
+def compute_risk_features(snapshot, workers=None, min_rows=PARALLEL_MIN_ROWS):
+    # Признаки всех клиентов снимка: в пуле процессов по шардам клиентов или в одном процессе.
+    # Возвращает (таблица признаков, отчет о расчете).
+    started = time.perf_counter()
+    workers = workers or os.cpu_count() or 1
+    client_ids = snapshot.load(['client_id'])['client_id']
+    report = {'rows': len(client_ids), 'workers': 1, 'shards': 1, 'mode': 'single'}
+    features = None
+    if workers > 1 and len(client_ids) >= min_rows:
+        shards = shard_positions(client_ids, workers * SHARDS_PER_WORKER)
+        try:
+            # spawn: процесс дашборда многопоточный, fork из него небезопасен
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                     initializer=_init_worker,
+                                     initargs=(snapshot.source_path, snapshot.mapping_registry.path,
+                                               snapshot.directory)) as executor:
+                parts = list(executor.map(_shard_features, shards))
+            features = pd.concat(parts)
+            report.update(workers=workers, shards=len(shards), mode='parallel')
+        except (BrokenProcessPool, OSError) as error:
+            # Нет процессов или семафоров (контейнер, песочница) - тот же расчет в текущем процессе
+            report['fallback'] = repr(error)
+    if features is None:
+        features = client_features(snapshot.load(FEATURE_COLUMNS))
+    features = finish_features(features)
+    report.update(clients=len(features), seconds=round(time.perf_counter() - started, 3))
+    return features, report
+
+
+def load_risk_features(snapshot, workers=None):
+    # Таблица хранится в папке снимка и перестраивается вместе с ним; считает один воркер, остальные ждут.
+    # Блокировка своя, не снимка: процесс этапа сам может ждать блокировку снимка, если выгрузка сменилась
+    path = os.path.join(snapshot.directory, FEATURES_FILE)
+    sources = snapshot.manifest()['sources']
+    stored = _read_features(path, sources)
+    if stored is None:
+        with file_lock(snapshot.directory + '.features.lock'):
+            stored = _read_features(path, sources)
+            if stored is None:
+                workers = workers or os.cpu_count() or 1
+                if workers > 1 and snapshot.open().rows >= PARALLEL_MIN_ROWS:
+                    stored = _run_stage(snapshot, path, sources, workers)
+                else:
+                    # Пул не нужен - отдельный процесс только добавил бы время запуска
+                    features, report = compute_risk_features(snapshot, workers=1)
+                    stored = _write_features(path, sources, features, report)
+    return stored['features']
+
+
+def read_risk_features(snapshot):
+    # Готовая таблица признаков без расчета: None, если этап для текущего снимка еще не отработал
+    stored = _read_features(os.path.join(snapshot.directory, FEATURES_FILE), snapshot.open().sources)
+    return None if stored is None else stored['features']
+
+
+def _run_stage(snapshot, path, sources, workers):
+    # Расчет - отдельным процессом: пул запускается из легкого __main__ этого модуля,
+    # процессы spawn не импортируют заново модуль дашборда
+    command = [sys.executable, os.path.abspath(__file__), snapshot.source_path, '--snapshot', snapshot.directory,
+               '--mapping', snapshot.mapping_registry.path, '--workers', str(workers)]
+    try:
+        completed = subprocess.run(command, capture_output=True, text=True, timeout=STAGE_TIMEOUT)
+        error = completed.stderr.strip().splitlines()[-1:] if completed.returncode else None
+    except subprocess.TimeoutExpired:
+        error = [f"Этап не завершился за {STAGE_TIMEOUT} с"]
+    stored = _read_features(path, sources) if error is None else None
+    if stored is None:
+        # Этап не отработал (или посчитал другую версию снимка) - считаем в текущем процессе
+        features, report = compute_risk_features(snapshot, workers=1)
+        report['fallback'] = error
+        stored = _write_features(path, sources, features, report)
+    return stored
+
+
+def _write_features(path, sources, features, report):
+    stored = {'sources': sources, 'features': features, 'report': report}
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(stored, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+    return stored
+
+
+def _read_features(path, sources):
+    try:
+        with open(path, 'rb') as f:
+            stored = pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return None
+    return stored if stored['sources'] == sources else None
+
+
+# Этап расчета признаков; запускается дашбордом или заранее, до запуска воркеров:
+# python risk_features.py client_5.csv [--snapshot папка] [--workers N]
+if __name__ == '__main__':
+    from mapping_registry import MappingRegistry
+
+    parser = argparse.ArgumentParser(description="Признаки риска клиентов по снимку выгрузки")
+    parser.add_argument('path')
+    parser.add_argument('--snapshot', default='snapshot')
+    parser.add_argument('--mapping', default="maping_csv.csv")
+    parser.add_argument('--workers', type=int, default=0, help="Процессов пула (0 - по числу ядер)")
+    parser.add_argument('--min-rows', type=int, default=PARALLEL_MIN_ROWS,
+                        help="Меньше строк - расчет в одном процессе")
+    args = parser.parse_args()
+
+    snapshot = ColumnarSnapshot(args.path, MappingRegistry(args.mapping), directory=args.snapshot)
+    features, report = compute_risk_features(snapshot, args.workers, args.min_rows)
+    _write_features(os.path.join(snapshot.directory, FEATURES_FILE), snapshot.manifest()['sources'], features, report)
+    print(features.head(10).to_string())
+    print(report, file=sys.stderr)
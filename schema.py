@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+
+
+# Схема таблицы кредитов (выгрузка бюро). Колонки, не перечисленные ниже, читаются числами float64.
+# Даты: все поля *_dt / *_date, а не только три даты выдачи и погашения
+DATE_COLUMNS = ['reporting_dt', 'fund_date', 'trade_opened_dt', 'trade_close_dt',
+                'paymnt_condition_principal_terms_amt_dt', 'paymnt_condition_interest_terms_amt_dt',
+                'paymnt_condition_grace_start_dt', 'paymnt_condition_grace_end_dt',
+                'paymnt_condition_interest_payment_due_date', 'overall_val_credit_total_amt_date',
+                'month_aver_paymt_calc_date', 'collat_insured_insur_start_dt', 'collat_insured_insur_end_dt',
+                'collat_insured_insur_fact_end_dt', 'collat_repay_dt', 'loan_indicator_dt', 'legal_items_court_act_dt',
+                'hold_dt', 'file_since_dt', 'last_updated_dt', 'last_uploaded_dt', 'arrear_calc_date',
+                'due_arrear_start_dt', 'due_arrear_calc_date', 'past_due_dt', 'past_due_calc_date',
+                'past_due_principal_missed_date', 'past_due_int_missed_date']
+# Признаки 0/1 - int8, пустое значение признака = 0
+FLAG_COLUMNS = ['trade_is_consumer_loan', 'trade_has_card', 'trade_is_novation', 'has_collaterals', 'has_guarantees',
+                'has_indie_guarantees', 'arrear_sign']
+# Счетчики просрочек по истории платежей (не только 0/1) - int16
+COUNT_COLUMNS = ['delay5', 'delay30', 'delay60', 'delay90', 'delay_more']
+# Коды с небольшим числом значений - категории; вид займа и цель - после расшифровки справочником
+CATEGORY_COLUMNS = ['account_amt_currency_code', 'trade_loan_kind_code', 'trade_acct_type1']
+DATE_FORMAT = '%Y-%m-%d'
+# Версия схемы входит в отпечаток снимка и разделов: при смене типов они перестраиваются
+SCHEMA_VERSION = 2
+
+# Колонки, которые читает каждый потребитель таблицы (year считается из fund_date при загрузке).
+# Остальные колонки нужны только свободным вопросам к GigaChat и берутся из снимка по требованию.
+PROJECTIONS = {
+    'filter_index': ['year', 'account_amt_currency_code', 'client_id'],
+    'agg_cube': ['year', 'account_amt_currency_code', 'client_id', 'loan_indicator', 'account_amt_credit_limit',
+                 'overall_val_credit_total_amt', 'overall_val_credit_total_monetary_amt'],
+    'debt_series': ['fund_date', 'loan_indicator', 'loan_indicator_dt', 'account_amt_credit_limit',
+                    'overall_val_credit_total_monetary_amt'],
+    'payment_history': ['reporting_dt', 'attr_value'],
+    'amortization': ['reporting_dt', 'trade_close_dt', 'loan_indicator', 'arrear_principal_outstanding',
+                     'account_amt_credit_limit', 'paymnt_condition_terms_frequency', 'overall_val_credit_total_amt',
+                     'paymnt_condition_grace_end_dt'],
+    'charts': ['fund_date', 'trade_loan_kind_code', 'trade_acct_type1', 'account_amt_credit_limit',
+               'paymnt_condition_principal_terms_amt', 'paymnt_condition_principal_terms_amt_dt',
+               'paymnt_condition_interest_terms_amt', 'paymnt_condition_interest_terms_amt_dt',
+               'overall_val_credit_total_amt', 'loan_indicator'],
+    'arrears': ['arrear_sign', 'account_uid', 'arrear_amt_outstanding', 'arrear_calc_date', 'due_arrear_start_dt',
+                'past_due_amt_past_due', 'overall_val_credit_total_amt'],
+    'debt_to_income': ['reporting_dt', 'fund_date', 'trade_close_dt', 'loan_indicator', 'loan_indicator_dt',
+                       'paymnt_condition_terms_frequency', 'paymnt_condition_principal_terms_amt',
+                       'paymnt_condition_interest_terms_amt', 'account_amt_credit_limit',
+                       'overall_val_credit_total_amt', 'month_aver_paymt_aver_paymt_amt'],
+}
+
+
+def columns_for(*consumers):
+    # Объединение проекций в порядке объявления, без повторов
+    return list(dict.fromkeys(column for consumer in consumers for column in PROJECTIONS[consumer]))
+
+
+# Рабочая таблица дашборда: только колонки, которые читают его потребители
+LOAN_COLUMNS = columns_for(*PROJECTIONS)
+
+
+def read_loans(path, chunksize=None):
+    # Даты читаются строками и разбираются в apply_schema одним форматом (и в кусках, и целиком)
+    return pd.read_csv(path, delimiter=';', encoding="utf-8", chunksize=chunksize,
+                       dtype={column: str for column in DATE_COLUMNS})
+
+
+def apply_schema(df):
+    # Приведение типов по схеме; повторный вызов ничего не меняет
+    for column in df.columns.intersection(DATE_COLUMNS):
+        if not pd.api.types.is_datetime64_dtype(df[column]):
+            df[column] = pd.to_datetime(df[column], format=DATE_FORMAT, errors='coerce')
+    for column in df.columns.intersection(FLAG_COLUMNS):
+        df[column] = df[column].fillna(0).astype(np.int8)
+    for column in df.columns.intersection(COUNT_COLUMNS):
+        df[column] = df[column].fillna(0).astype(np.int16)
+    for column in df.columns.intersection(CATEGORY_COLUMNS):
+        if not isinstance(df[column].dtype, pd.CategoricalDtype):
+            df[column] = df[column].astype('category')
+    return df
@@ -0,0 +1,162 @@
+import json
+import os
+import shutil
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from dataset import prepare_loans
+from schema import read_loans
+from storage import data_sources, locked_manifest
+
+
+def memory_report():
+    # Память процесса из /proc: анонимная (своя у воркера) и файловая (страницы снимка, общие для воркеров)
+    fields = {}
+    try:
+        with open('/proc/self/status', encoding='ascii') as f:
+            for line in f:
+                name, _, value = line.partition(':')
+                if name in ('VmRSS', 'RssAnon', 'RssFile', 'VmHWM'):
+                    fields[name] = int(value.split()[0]) / 1024
+    except OSError:
+        pass
+    return {'rss_mb': round(fields.get('VmRSS', 0), 1), 'private_mb': round(fields.get('RssAnon', 0), 1),
+            'shared_file_mb': round(fields.get('RssFile', 0), 1), 'peak_rss_mb': round(fields.get('VmHWM', 0), 1)}
+
+
+# Подготовленная выгрузка (коды расшифрованы, год посчитан) в виде колонок NumPy на диске.
+# Воркеры gunicorn отображают файлы в память только для чтения (mmap) и делят физические страницы,
+# вместо того чтобы каждый разбирал CSV и держал свою копию. Числа и даты отображаются как есть,
+# строки хранятся словарем: коды - в отображаемом файле, в воркере - только ссылки на разные значения.
+# Снимок хранит все колонки; дашборд берет проекцию, остальные колонки читаются по требованию.
+# Снимок перестраивается, только если изменились выгрузка, справочник или схема типов.
+class ColumnarSnapshot:
+    def __init__(self, source_path, mapping_registry, directory='snapshot'):
+        self.source_path = source_path
+        self.mapping_registry = mapping_registry
+        self.directory = directory
+        self.rows = 0
+        self.sources = None
+        self.nbytes = 0
+        self._columns = None  # имя -> (описание, отображенный массив, словарь значений)
+        self._string_values = {}
+
+    @property
+    def manifest_path(self):
+        return os.path.join(self.directory, 'manifest.json')
+
+    def _sources(self):
+        return data_sources(self.source_path, self.mapping_registry.path)
+
+    def manifest(self):
+        return locked_manifest(self.manifest_path, self._sources(), self.directory + '.lock', self.build)
+
+    def build(self):
+        started = time.perf_counter()
+        df = prepare_loans(read_loans(self.source_path), self.mapping_registry.get())
+        tmp_directory = self.directory + '.tmp'
+        shutil.rmtree(tmp_directory, ignore_errors=True)
+        os.makedirs(tmp_directory)
+        columns = []
+        for number, column in enumerate(df.columns):
+            columns.append(self._write_column(tmp_directory, f'{number:03d}', column, df[column]))
+        manifest = {'sources': self._sources(), 'rows': len(df), 'columns': columns,
+                    'build_seconds': round(time.perf_counter() - started, 3)}
+        with open(os.path.join(tmp_directory, 'manifest.json'), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        # Старый снимок может быть отображен другими воркерами: после удаления их страницы остаются живы
+        shutil.rmtree(self.directory, ignore_errors=True)
+        os.replace(tmp_directory, self.directory)
+        return manifest
+
+    @staticmethod
+    def _write_column(directory, name, column, series):
+        entry = {'name': column, 'file': name + '.npy'}
+        if isinstance(series.dtype, pd.CategoricalDtype) or pd.api.types.infer_dtype(series, skipna=True) in ('string', 'empty'):
+            # Строки и категории: коды (-1 - пусто) и словарь значений
+            categorical = pd.Categorical(series)
+            categories = categorical.categories.to_numpy()
+            entry.update(kind='category' if isinstance(series.dtype, pd.CategoricalDtype) else 'string',
+                         ordered=bool(categorical.ordered), categories=name + '.categories.npy')
+            np.save(os.path.join(directory, entry['file']), categorical.codes)
+            np.save(os.path.join(directory, entry['categories']),
+                    categories.astype(str) if categories.dtype == object else categories)
+        elif isinstance(series.dtype, np.dtype) and series.dtype.kind in 'biufmM':
+            entry['kind'] = 'array'
+            np.save(os.path.join(directory, entry['file']), series.to_numpy())
+        else:
+            # Смешанные типы отображать нельзя - колонка сохраняется целиком и копируется в каждый воркер
+            entry.update(kind='pickle', file=name + '.pkl')
+            series.reset_index(drop=True).to_pickle(os.path.join(directory, entry['file']))
+        return entry
+
+    def open(self):
+        # Отображение всех колонок снимка один раз: страницы читаются с диска только при обращении,
+        # и таблица остается согласованной, даже если другой воркер перестроит снимок
+        if self._columns is None:
+            manifest = self.manifest()
+            columns = {}
+            nbytes = 0
+            for entry in manifest['columns']:
+                path = os.path.join(self.directory, entry['file'])
+                if entry['kind'] == 'pickle':
+                    columns[entry['name']] = (entry, pd.read_pickle(path).to_numpy(), None)
+                    continue
+                values = np.load(path, mmap_mode='r').view(np.ndarray)  # те же страницы, без подкласса memmap
+                nbytes += values.nbytes
+                categories = (np.load(os.path.join(self.directory, entry['categories']))
+                              if 'categories' in entry else None)
+                if categories is not None and categories.dtype.kind == 'U':
+                    categories = categories.astype(object)
+                columns[entry['name']] = (entry, values, categories)
+            self.rows = manifest['rows']
+            self.sources = manifest['sources']  # отпечаток данных, из которых построен отображенный снимок
+            self.nbytes = nbytes
+            self._columns = columns
+        return self
+
+    @property
+    def columns(self):
+        return list(self.open()._columns)
+
+    def _strings(self, name, categories):
+        # Набор различных строк колонки (и NaN для кода -1) создается в воркере один раз
+        strings = self._string_values.get(name)
+        if strings is None:
+            strings = self._string_values[name] = np.append(categories, np.nan).astype(object)
+        return strings
+
+    def load(self, columns=None, positions=None):
+        # Таблица из отображенных колонок: columns - проекция, positions - только эти строки.
+        # Без positions числа и даты не копируются, строки - массив ссылок на общий набор значений.
+        self.open()
+        data = {}
+        for name in columns or self._columns:
+            entry, values, categories = self._columns[name]
+            if positions is not None:
+                values = values[positions]
+            if entry['kind'] == 'category':
+                data[name] = pd.Categorical.from_codes(values, categories, ordered=entry['ordered'])
+            elif entry['kind'] == 'string':
+                data[name] = self._strings(name, categories)[values]
+            else:
+                data[name] = values
+        rows = self.rows if positions is None else len(positions)
+        # copy=False: колонки остаются отдельными блоками поверх отображенных файлов, без консолидации
+        return pd.DataFrame(data, index=pd.RangeIndex(rows), copy=False)
+
+
+# Построение снимка заранее (до запуска воркеров): python snapshot.py client_5.csv [папка]
+if __name__ == '__main__':
+    from mapping_registry import MappingRegistry
+    snapshot = ColumnarSnapshot(sys.argv[1], MappingRegistry("maping_csv.csv"),
+                                directory=sys.argv[2] if len(sys.argv) > 2 else 'snapshot')
+    built = snapshot.build()
+    started = time.perf_counter()
+    df = snapshot.load()
+    print(f"Строк: {built['rows']}, колонок: {len(built['columns'])}, построение: {built['build_seconds']} с, "
+          f"загрузка: {time.perf_counter() - started:.3f} с, отображено: {snapshot.nbytes / 1024 ** 2:.1f} МБ")
+    print(memory_report())
@@ -0,0 +1,59 @@
+import fcntl
+import json
+import os
+import sqlite3
+from contextlib import contextmanager
+
+from schema import SCHEMA_VERSION
+
+
+# Общие помощники данных на диске: снимок колонок и разбиение по клиентам перестраиваются по отпечатку
+# исходных файлов под межпроцессной блокировкой, кэш ответов и задания LLM живут в общем SQLite
+
+
+def fingerprint(path):
+    stat = os.stat(path)
+    return {'path': os.path.abspath(path), 'mtime': stat.st_mtime_ns, 'size': stat.st_size}
+
+
+def data_sources(source_path, mapping_path, **extra):
+    # Отпечаток того, из чего построены данные: выгрузка, справочник, схема типов и параметры раскладки
+    return {'source': fingerprint(source_path), 'mapping': fingerprint(mapping_path), 'schema': SCHEMA_VERSION,
+            **extra}
+
+
+@contextmanager
+def file_lock(path):
+    # Исключительная блокировка между воркерами gunicorn (fcntl, снимается при закрытии файла)
+    with open(path, 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        yield
+
+
+def read_manifest(path, sources):
+    try:
+        with open(path, encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    # Выгрузка, справочник или схема изменились - данные нужно перестроить
+    return manifest if manifest.get('sources') == sources else None
+
+
+def locked_manifest(path, sources, lock_path, build):
+    # Воркеры стартуют одновременно: строит один, остальные ждут блокировку и читают готовый результат
+    manifest = read_manifest(path, sources)
+    if manifest is None:
+        with file_lock(lock_path):
+            manifest = read_manifest(path, sources) or build()
+    return manifest
+
+
+@contextmanager
+def sqlite_connection(path, timeout=5):
+    conn = sqlite3.connect(path, timeout=timeout)
+    try:
+        with conn:  # commit/rollback
+            yield conn
+    finally:
+        conn.close()
@@ -0,0 +1,119 @@
+import argparse
+import re
+import time
+
+import numpy as np
+import pandas as pd
+
+
+# Выгрузки-образцы: из них берутся схема (92 колонки в исходном порядке) и распределения значений
+SAMPLE_FILES = ["client_5.csv", "credits.csv"]
+REPORTING_DATES = np.array(['2023-08-26', '2023-09-17'], dtype='datetime64[D]')
+# Суммы масштабируются одним множителем на строку, ПСК (overall_val_credit_total_amt) - процент, не сумма
+AMOUNT_COLUMN = re.compile(r'(_amt|outstanding|limit|paymt|overdue)')
+NOT_AMOUNTS = {'overall_val_credit_total_amt', 'account_amt_currency_code'}
+MAX_SHIFT_DAYS = 8 * 365
+LOANS_PER_CLIENT = 30
+
+
+def _is_date(column):
+    return column.endswith(('_dt', '_date')) or column == 'fund_date'
+
+
+# Профиль образцов: строки-шаблоны как строки CSV, даты - как datetime64[D] (даты 2260 года не переполняются)
+class SampleProfile:
+    def __init__(self, paths=SAMPLE_FILES):
+        templates = pd.concat([pd.read_csv(path, delimiter=';', dtype=str) for path in paths], ignore_index=True)
+        self.columns = list(templates.columns)
+        self.text = {column: templates[column].fillna('').to_numpy(dtype=object) for column in self.columns}
+        self.dates = {column: np.array(templates[column].fillna('').to_list(), dtype='datetime64[D]')
+                      for column in self.columns if _is_date(column) and column != 'reporting_dt'}
+        self.amounts = {column: pd.to_numeric(templates[column], errors='coerce').to_numpy(dtype=float)
+                        for column in self.columns
+                        if AMOUNT_COLUMN.search(column) and not _is_date(column) and column not in NOT_AMOUNTS}
+        self.size = len(templates)
+
+
+def _format_dates(values):
+    text = np.datetime_as_string(values, unit='D').astype(object)
+    text[np.isnat(values)] = ''
+    return text
+
+
+def _format_amounts(values):
+    text = np.char.mod('%.2f', np.nan_to_num(values)).astype(object)
+    text[np.isnan(values)] = ''
+    return text
+
+
+def _attr_values(rng, report, fund, close, closed):
+    # История платежей: первый символ - месяц отчета, далее на месяц раньше до месяца выдачи.
+    # После закрытия кредита - «C», в остальные месяцы в основном «0», иногда просрочки и «-».
+    report_month = report.astype('datetime64[M]').astype(np.int64)
+    fund_month = fund.astype('datetime64[M]').astype(np.int64)
+    close_month = np.where(np.isnat(close), report_month + 1, close.astype('datetime64[M]').astype(np.int64))
+    length = np.clip(report_month - np.where(np.isnat(fund), report_month, fund_month) + 1, 1, 120)
+    width = int(length.max())
+    states = np.frombuffer(b'0000000000000000000000000001123A-', dtype=np.uint8)
+    chars = states[rng.integers(0, len(states), size=(len(report), width))]
+    month = report_month[:, None] - np.arange(width)[None, :]
+    chars[closed[:, None] & (month >= close_month[:, None])] = ord('C')
+    chars[np.arange(width)[None, :] >= length[:, None]] = 0
+    return np.char.decode(chars.view(f'S{width}').ravel(), 'ascii').astype(object)
+
+
+def generate_chunk(profile, rows, rng, first_row=0, clients=None):
+    clients = clients or max(rows // LOANS_PER_CLIENT, 1)
+    template = rng.integers(0, profile.size, rows)
+    client = rng.integers(0, clients, rows)
+    # Даты строки сдвигаются в прошлое одним сдвигом, суммы - одним множителем
+    shift = rng.integers(0, MAX_SHIFT_DAYS, rows).astype('timedelta64[D]')
+    scale = rng.lognormal(0.0, 0.8, rows)
+    # Дата отчета и идентификаторы - на уровне клиента
+    client_report = REPORTING_DATES[np.arange(clients) % len(REPORTING_DATES)]
+
+    out = {}
+    for column in profile.columns:
+        if column in profile.dates:
+            out[column] = _format_dates(profile.dates[column][template] - shift)
+        elif column in profile.amounts:
+            out[column] = _format_amounts(np.round(profile.amounts[column][template] * scale, 2))
+        else:
+            out[column] = profile.text[column][template]
+    out['client_id'] = (client + 100_000).astype(str)
+    out['application_id'] = (client + 50_000_000).astype(str)
+    out['equifax_id'] = (client + 10_000_000).astype(str)
+    out['account_uid'] = (np.arange(first_row, first_row + rows, dtype=np.int64) * 7919 + 10 ** 17).astype(str)
+    report = client_report[client]
+    out['reporting_dt'] = _format_dates(report)
+    closed = profile.text['loan_indicator'][template] != ''
+    out['attr_value'] = _attr_values(rng, report, profile.dates['fund_date'][template] - shift,
+                                     profile.dates['trade_close_dt'][template] - shift, closed)
+    return pd.DataFrame(out, columns=profile.columns)
+
+
+# Синтетическая выгрузка бюро в схеме client_5.csv / credits.csv, пишется кусками (до десятков миллионов строк)
+def generate(path, rows, seed=0, chunk_rows=200_000, profile=None):
+    profile = profile or SampleProfile()
+    rng = np.random.default_rng(seed)
+    clients = max(rows // LOANS_PER_CLIENT, 1)
+    written = 0
+    while written < rows or written == 0:
+        size = min(chunk_rows, rows - written)
+        chunk = generate_chunk(profile, size, rng, first_row=written, clients=clients)
+        chunk.to_csv(path, sep=';', index=False, header=written == 0, mode='w' if written == 0 else 'a')
+        written += size
+        if size == 0:
+            break
+    return path
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Генератор синтетической выгрузки бюро")
+    parser.add_argument('path')
+    parser.add_argument('--rows', type=int, default=10_000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    started = time.perf_counter()
+    generate(args.path, args.rows, args.seed)
+    print(f"Строк: {args.rows}, секунд: {time.perf_counter() - started:.1f}")
@@ -0,0 +1,83 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+
+# Операторы filter_query таблицы Dash (в т.ч. словесные синонимы из встроенной подсказки)
+OPERATORS = {
+    'eq': 'eq', '=': 'eq', 'ne': 'ne', '!=': 'ne',
+    'lt': 'lt', '<': 'lt', 'le': 'le', '<=': 'le',
+    'gt': 'gt', '>': 'gt', 'ge': 'ge', '>=': 'ge',
+    'contains': 'contains', 'datestartswith': 'datestartswith'
+}
+# Одно условие: {колонка} оператор значение, значение может быть в кавычках.
+# Перед оператором может стоять регистр из filter_options таблицы: i - без учета регистра, s - с учетом
+FILTER_PART = re.compile(r'^\{(?P<column>[^}]+)\}\s*(?P<case>[is]?)'
+                         r'(?P<operator>[!<>=]=?|eq|ne|lt|le|gt|ge|contains|datestartswith)\s*(?P<value>.*)$')
+UNARY_PART = re.compile(r'^\{(?P<column>[^}]+)\}\s*is (?P<negate>not )?blank$')
+
+
+def _parse_value(raw):
+    raw = raw.strip()
+    if len(raw) >= 2 and raw[0] == raw[-1] and raw[0] in '"\'`':
+        return raw[1:-1]
+    return raw
+
+
+def parse_filter(filter_query):
+    # 'cond && cond && ...' -> [(колонка, оператор, значение, без учета регистра)], незнакомые части пропускаются
+    conditions = []
+    for part in (filter_query or '').split(' && '):
+        part = part.strip()
+        match = UNARY_PART.match(part)
+        if match:
+            conditions.append((match['column'], 'notblank' if match['negate'] else 'blank', None, False))
+            continue
+        match = FILTER_PART.match(part)
+        if match:
+            conditions.append((match['column'], OPERATORS[match['operator']], _parse_value(match['value']),
+                               match['case'] == 'i'))
+    return conditions
+
+
+def _mask(series, operator, value, insensitive=False):
+    if operator == 'blank':
+        return series.isna() | (series.astype(str).str.strip() == '')
+    if operator == 'notblank':
+        return series.notna() & (series.astype(str).str.strip() != '')
+    present = series.notna()
+    if operator in ('contains', 'datestartswith'):
+        text = series.astype(str)
+        if insensitive:
+            text, value = text.str.lower(), value.lower()
+        return present & (text.str.contains(value, regex=False) if operator == 'contains' else text.str.startswith(value))
+    # Числовую колонку сравниваем с числом, остальные - как строки (даты в ISO сравниваются корректно)
+    if pd.api.types.is_numeric_dtype(series):
+        try:
+            return present & getattr(series, operator)(float(value))
+        except ValueError:
+            pass
+    text = series.astype(str)
+    if insensitive:
+        text, value = text.str.lower(), value.lower()
+    return present & getattr(text, operator)(value)
+
+
+# Фильтрация, сортировка и страница таблицы на сервере: в браузер уходит только видимая страница
+def query_table(df, filter_query='', sort_by=None, page_current=0, page_size=10):
+    mask = np.ones(len(df), dtype=bool)
+    for column, operator, value, insensitive in parse_filter(filter_query):
+        if column in df.columns:
+            mask &= _mask(df[column], operator, value, insensitive).to_numpy(dtype=bool)
+    result = df[mask] if not mask.all() else df
+    sort_by = [s for s in (sort_by or []) if s['column_id'] in df.columns]
+    if sort_by:
+        result = result.sort_values([s['column_id'] for s in sort_by],
+                                    ascending=[s['direction'] == 'asc' for s in sort_by],
+                                    kind='mergesort', na_position='last')
+    total = len(result)
+    page_count = max(-(-total // page_size), 1)
+    page_current = min(max(page_current or 0, 0), page_count - 1)
+    start = page_current * page_size
+    return result.iloc[start:start + page_size], total, page_count